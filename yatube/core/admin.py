@@ -0,0 +1,23 @@
+from django.contrib import admin
+
+from core.models import SlowQuery
+
+
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = (
+        'sql', 'count', 'total_ms', 'max_ms', 'rows', 'view_name',
+        'last_seen',
+    )
+    list_filter = ('view_name',)
+    search_fields = ('sql',)
+    readonly_fields = (
+        'fingerprint', 'sql', 'count', 'total_ms', 'max_ms', 'rows',
+        'view_name', 'stack', 'last_seen',
+    )
+    empty_value_display = '-пусто-'
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(SlowQuery, SlowQueryAdmin)
@@ -0,0 +1,315 @@
+import math
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+from django.core.cache import cache as default_cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from core.profiling import current_profile
+
+_missing = object()
+# get_many of some backends calls get, those keys are counted once.
+_counting = ContextVar('counting_cache_lookups', default=True)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, '
+    'accessed REAL NOT NULL) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE TABLE IF NOT EXISTS cache_size ('
+    'id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO cache_size VALUES (0, 0)',
+    'CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache '
+    'BEGIN UPDATE cache_size SET entries = entries + 1; END',
+    'CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache '
+    'BEGIN UPDATE cache_size SET entries = entries - 1; END',
+)
+UPSERT = (
+    'INSERT INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?) '
+    'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+    'expires = excluded.expires, accessed = excluded.accessed'
+)
+
+
+class SQLiteCache(BaseCache):
+    '''Cache kept in a SQLite file in WAL mode, shared by all workers.
+
+    LOCATION is the path of the file. Size is bounded by MAX_ENTRIES:
+    past it expired entries go first, then the least recently used
+    1/CULL_FREQUENCY of the rest. Access times are refreshed at most
+    once per ACCESS_RESOLUTION seconds so that hot reads stay read-only.
+    '''
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.location = location
+        options = params.get('OPTIONS', {})
+        self.access_resolution = float(options.get('ACCESS_RESOLUTION', 1))
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        '''Connection of the current thread, reopened after a fork.'''
+        if getattr(self.local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.location)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(
+                self.location, timeout=10, isolation_level=None,
+                check_same_thread=False,
+            )
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            self.local.db, self.local.pid = db, os.getpid()
+        return self.local.db
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _dumps(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def _touch_accessed(self, rows, now):
+        stale = [
+            (now, key) for key, accessed in rows
+            if now - accessed > self.access_resolution
+        ]
+        if stale:
+            self.db.executemany(
+                'UPDATE cache SET accessed = ? WHERE key = ?', stale
+            )
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        row = self.db.execute(
+            'SELECT value, expires, accessed FROM cache WHERE key = ?',
+            (key,),
+        ).fetchone()
+        now = time.time()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return default
+        self._touch_accessed([(key, row[2])], now)
+        return pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        names = {self._key(key, version): key for key in keys}
+        if not names:
+            return {}
+        now = time.time()
+        rows = self.db.execute(
+            'SELECT key, value, expires, accessed FROM cache '
+            f'WHERE key IN ({", ".join("?" * len(names))})',
+            list(names),
+        ).fetchall()
+        rows = [row for row in rows if row[2] is None or row[2] > now]
+        self._touch_accessed([(row[0], row[3]) for row in rows], now)
+        return {names[row[0]]: pickle.loads(row[1]) for row in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.db.execute(UPSERT, (
+            self._key(key, version), self._dumps(value),
+            self.get_backend_timeout(timeout), time.time(),
+        ))
+        self._cull()
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        rows = [
+            (self._key(key, version), self._dumps(value), expires, now)
+            for key, value in data.items()
+        ]
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(UPSERT, rows)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        self._cull()
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        cursor = self.db.execute(
+            UPSERT + ' WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (
+                self._key(key, version), self._dumps(value),
+                self.get_backend_timeout(timeout), now, now,
+            ),
+        )
+        added = cursor.rowcount == 1
+        if added:
+            self._cull()
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                'SELECT value, expires FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= time.time()):
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            db.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (self._dumps(value), key),
+            )
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self.db.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (
+                self.get_backend_timeout(timeout), self._key(key, version),
+                time.time(),
+            ),
+        )
+        return cursor.rowcount == 1
+
+    def has_key(self, key, version=None):
+        return self.db.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self._key(key, version), time.time()),
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.db.execute(
+            'DELETE FROM cache WHERE key = ?', (self._key(key, version),)
+        )
+
+    def delete_many(self, keys, version=None):
+        self.db.executemany(
+            'DELETE FROM cache WHERE key = ?',
+            [(self._key(key, version),) for key in keys],
+        )
+
+    def clear(self):
+        self.db.execute('DELETE FROM cache')
+
+    def _cull(self):
+        db = self.db
+        entries, = db.execute('SELECT entries FROM cache_size').fetchone()
+        if entries <= self._max_entries:
+            return
+        db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        entries, = db.execute('SELECT entries FROM cache_size').fetchone()
+        if entries <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            self.clear()
+            return
+        db.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+            'ORDER BY accessed LIMIT ?)',
+            (entries // self._cull_frequency,),
+        )
+
+
+class InstrumentedCacheMixin:
+    '''Counts cache hits and misses of the current request.'''
+
+    def _count(self, hits, misses):
+        profile = current_profile.get()
+        if profile is not None and _counting.get():
+            profile.cache_hits += hits
+            profile.cache_misses += misses
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        self._count(value is not _missing, value is _missing)
+        return default if value is _missing else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        token = _counting.set(False)
+        try:
+            values = super().get_many(keys, version)
+        finally:
+            _counting.reset(token)
+        self._count(len(values), len(keys) - len(values))
+        return values
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    pass
+
+
+class InstrumentedSQLiteCache(InstrumentedCacheMixin, SQLiteCache):
+    pass
+
+
+def _release(lock, token, cache):
+    '''Deletes `lock` if it is still held with `token`.
+
+    A lock that expired during the computation may already belong to
+    another caller. The check and the delete are two calls, the window
+    between them is what the cache API allows.
+    '''
+    if cache.get(lock) == token:
+        cache.delete(lock)
+
+
+def get_or_refresh(key, compute, timeout, grace=0, lock_timeout=10,
+                   beta=1.0, poll=0.05, cache=default_cache):
+    '''Cached value of `compute()`, recomputed by one caller at a time.
+
+    Values are fresh for `timeout` seconds and then served stale for
+    `grace` more while the caller holding `<key>:lock` recomputes them.
+    Before expiry a caller may refresh early, more likely the closer the
+    expiry and the longer the last computation took (beta scales this,
+    0 disables it). On a miss other callers wait for the value instead
+    of computing it as well; only a caller holding the lock computes, a
+    lock left by a crashed holder expires after `lock_timeout`.
+    '''
+    lock = f'{key}:lock'
+    token = uuid.uuid4().hex
+    entry = cache.get(key)
+    if entry is not None:
+        value, expires, took = entry
+        early = took * beta * -math.log(1 - random.random())
+        if time.time() + early < expires or not cache.add(
+            lock, token, lock_timeout
+        ):
+            return value
+    else:
+        while not cache.add(lock, token, lock_timeout):
+            time.sleep(poll)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        # The holder of the lock may have stored it since the miss above.
+        entry = cache.get(key)
+        if entry is not None:
+            _release(lock, token, cache)
+            return entry[0]
+    try:
+        start = time.perf_counter()
+        value = compute()
+        took = time.perf_counter() - start
+        cache.set(key, (value, time.time() + timeout, took), timeout + grace)
+    finally:
+        _release(lock, token, cache)
+    return value
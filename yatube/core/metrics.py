@@ -0,0 +1,269 @@
+import bisect
+import contextlib
+import fcntl
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from core.timing import HISTOGRAM_BOUNDS_MS
+
+# name: (type, help)
+METRICS = {
+    'yatube_requests_total': (
+        'counter', 'Requests by view and status code.'
+    ),
+    'yatube_request_duration_seconds': (
+        'histogram', 'Time to build a response by view.'
+    ),
+    'yatube_db_queries_total': ('counter', 'SQL queries by view.'),
+    'yatube_db_seconds_total': ('counter', 'Time spent in SQL by view.'),
+    'yatube_cache_hits_total': ('counter', 'Cache hits by view.'),
+    'yatube_cache_misses_total': ('counter', 'Cache misses by view.'),
+    'yatube_thumbnail_lookups_total': (
+        'counter', 'Thumbnail store lookups by the tier that answered.'
+    ),
+}
+BOUNDS_SECONDS = tuple(bound / 1000 for bound in HISTOGRAM_BOUNDS_MS)
+BUCKETS = tuple(str(bound) for bound in BOUNDS_SECONDS) + ('+Inf',)
+ARCHIVE = 'archive'
+
+
+def read_rows(path):
+    '''[name, labels, value] rows of a counters file, None if it is gone.'''
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_rows(path, rows):
+    '''Replaces a counters file in one step, readers never see half.'''
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(descriptor, 'w') as file:
+        json.dump(rows, file)
+    os.replace(temporary, path)
+
+
+@contextlib.contextmanager
+def locked(path, blocking=True):
+    '''Holds an exclusive flock on `path`, BlockingIOError if it is taken.'''
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(
+            descriptor, fcntl.LOCK_EX if blocking else
+            fcntl.LOCK_EX | fcntl.LOCK_NB
+        )
+        yield
+    finally:
+        os.close(descriptor)
+
+
+def retire(directory, pid):
+    '''Moves counters of an exited process into the archive.
+
+    The caller holds the process's lock. Sums stay where they were, a
+    drop would look like a counter reset to Prometheus.
+    '''
+    path = os.path.join(directory, f'{pid}.json')
+    with locked(os.path.join(directory, f'{ARCHIVE}.lock')):
+        rows = read_rows(path)
+        if rows is None:
+            return
+        archive = os.path.join(directory, f'{ARCHIVE}.json')
+        values = Counter()
+        for name, labels, value in (read_rows(archive) or []) + rows:
+            values[name, tuple(labels.items())] += value
+        write_rows(archive, [
+            [name, dict(labels), value]
+            for (name, labels), value in values.items()
+        ])
+        os.remove(path)
+
+
+class Registry:
+    '''Counters of this process, written to METRICS_DIR for the others.
+
+    Every series is a key of one Counter: (metric name, label pairs).
+    Processes merge by adding up their counters, which is all a scrape
+    of /metrics does.
+    '''
+
+    def __init__(self):
+        self.values = Counter()
+        self.lock = threading.Lock()
+        self.flushed = 0.0
+        self.held = set()
+
+    @functools.lru_cache(maxsize=None)
+    def keys(self, view_name, status):
+        '''Series keys a request of a view updates, built once per view.'''
+        view = (('view', view_name),)
+        duration = 'yatube_request_duration_seconds'
+        return {
+            'request': ('yatube_requests_total', view + (
+                ('status', str(status)),
+            )),
+            'buckets': [
+                (f'{duration}_bucket', view + (('le', le),)) for le in BUCKETS
+            ],
+            'sum': (f'{duration}_sum', view),
+            'count': (f'{duration}_count', view),
+            'queries': ('yatube_db_queries_total', view),
+            'db': ('yatube_db_seconds_total', view),
+            'hits': ('yatube_cache_hits_total', view),
+            'misses': ('yatube_cache_misses_total', view),
+        }
+
+    def record(self, view_name, status, profile):
+        keys = self.keys(view_name, status)
+        bucket = bisect.bisect_left(BOUNDS_SECONDS, profile.total)
+        with self.lock:
+            values = self.values
+            values[keys['request']] += 1
+            for key in keys['buckets'][bucket:]:
+                values[key] += 1
+            values[keys['sum']] += profile.total
+            values[keys['count']] += 1
+            values[keys['queries']] += profile.queries
+            values[keys['db']] += profile.times['db']
+            values[keys['hits']] += profile.cache_hits
+            values[keys['misses']] += profile.cache_misses
+
+    def snapshot(self):
+        '''Series of this process, thumbnail store counters included.'''
+        from sorl.thumbnail import default
+
+        with self.lock:
+            values = Counter(self.values)
+        stats = getattr(default.kvstore, 'stats', None)
+        if stats is not None:
+            counters = stats()
+            for tier, counter in (
+                ('lru', 'lru_hits'), ('file', 'file_hits'), ('miss', 'misses')
+            ):
+                values['yatube_thumbnail_lookups_total', (
+                    ('tier', tier),
+                )] = counters[counter]
+        return values
+
+    def path(self, extension='json'):
+        return os.path.join(
+            settings.METRICS_DIR, f'{os.getpid()}.{extension}'
+        )
+
+    def hold(self):
+        '''Locks <pid>.lock for as long as this process lives.
+
+        The kernel drops the lock when the process exits, so a scrape can
+        tell a gone worker from a new one that got the same pid. A file
+        under this pid found on first use was left by such a worker.
+        '''
+        path = self.path('lock')
+        if path in self.held:
+            return
+        while True:
+            descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+            # A scrape may have retired a predecessor and unlinked the file.
+            with contextlib.suppress(FileNotFoundError):
+                if os.stat(path).st_ino == os.fstat(descriptor).st_ino:
+                    break
+            os.close(descriptor)
+        self.held.add(path)
+        retire(settings.METRICS_DIR, os.getpid())
+
+    def flush(self, force=False):
+        '''Writes the snapshot for other processes, at most once a second.'''
+        now = time.monotonic()
+        if not settings.METRICS_DIR or (
+            not force and now - self.flushed < settings.METRICS_FLUSH_INTERVAL
+        ):
+            return
+        self.flushed = now
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        self.hold()
+        write_rows(self.path(), [
+            [name, dict(labels), value]
+            for (name, labels), value in self.snapshot().items()
+        ])
+
+    def collect(self):
+        '''Series of every process sharing METRICS_DIR.
+
+        Processes that are gone leave their lock free: their counters are
+        moved into the archive, which is added up along with the rest.
+        '''
+        values = self.snapshot()
+        directory = settings.METRICS_DIR
+        if not directory or not os.path.isdir(directory):
+            return values
+        own = self.path()
+        for entry in os.scandir(directory):
+            pid, extension = os.path.splitext(entry.name)
+            if entry.path == own or extension != '.json' or not pid.isdigit():
+                continue
+            lock = os.path.join(directory, f'{pid}.lock')
+            try:
+                with locked(lock, blocking=False):
+                    retire(directory, pid)
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(lock)
+                continue
+            except BlockingIOError:
+                pass
+            for name, labels, value in read_rows(entry.path) or ():
+                values[name, tuple(labels.items())] += value
+        archive = os.path.join(directory, f'{ARCHIVE}.json')
+        for name, labels, value in read_rows(archive) or ():
+            values[name, tuple(labels.items())] += value
+        return values
+
+
+registry = Registry()
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n'
+    )
+
+
+def series_order(item):
+    name, labels, _ = item
+    return name, tuple(
+        (key, float(value) if key == 'le' else value)
+        for key, value in labels
+    )
+
+
+def exposition(values):
+    '''Series in the Prometheus text format, version 0.0.4.'''
+    lines = []
+    for metric, (kind, help_text) in METRICS.items():
+        names = {metric}
+        if kind == 'histogram':
+            names = {f'{metric}_{suffix}' for suffix in (
+                'bucket', 'sum', 'count'
+            )}
+        series = sorted(
+            ((name, labels, value)
+             for (name, labels), value in values.items() if name in names),
+            key=series_order,
+        )
+        if not series:
+            continue
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for name, labels, value in series:
+            label_text = ','.join(
+                f'{key}="{escape(str(label))}"' for key, label in labels
+            )
+            lines.append(f'{name}{{{label_text}}} {value}')
+    return '\n'.join(lines) + '\n'
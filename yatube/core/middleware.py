@@ -0,0 +1,88 @@
+import logging
+
+from django.conf import settings
+from django.db import connection
+
+from core.metrics import registry
+from core.profiling import Profile, current_profile, time_query
+from core.query_budget import QueryRecorder, budget_problems
+from core.slow_queries import SlowQueryLog
+
+logger = logging.getLogger(__name__)
+profiling_logger = logging.getLogger('core.profiling')
+
+
+class QueryBudgetMiddleware:
+    '''Logs views that go over their query budget or repeat a query.'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        match = request.resolver_match
+        if match is not None:
+            problems = budget_problems(
+                match.view_name, recorder, require_budget=False
+            )
+            for problem in problems:
+                logger.warning('%s: %s', match.view_name, problem)
+        return response
+
+
+class ProfilingMiddleware:
+    '''Times SQL, templates, thumbnails and Python code of every request.
+
+    The split is sent to staff users in a Server-Timing header when
+    PROFILING_HEADER is set and logged per view name when PROFILING_LOG
+    is set. Every request
+    is also counted in core.metrics under its view name.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = Profile()
+        token = current_profile.set(profile)
+        try:
+            with connection.execute_wrapper(time_query):
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        profile.finish()
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        user = getattr(request, 'user', None)
+        if settings.PROFILING_HEADER and user and user.is_staff:
+            response['Server-Timing'] = profile.header()
+        if settings.PROFILING_LOG:
+            profiling_logger.info(
+                '%s %s %s', view_name, response.status_code,
+                profile.log_line(),
+            )
+        registry.record(view_name, response.status_code, profile)
+        registry.flush()
+        return response
+
+
+class SlowQueryMiddleware:
+    '''Records queries over SLOW_QUERY_THRESHOLD_MS when SLOW_QUERY_LOG is on.
+
+    It comes first so the records are saved after every other middleware
+    stopped counting queries.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.SLOW_QUERY_LOG:
+            return self.get_response(request)
+        log = SlowQueryLog(request)
+        with connection.execute_wrapper(log):
+            response = self.get_response(request)
+        log.flush()
+        return response
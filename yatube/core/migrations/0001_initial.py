@@ -0,0 +1,34 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True, verbose_name='отпечаток')),
+                ('sql', models.TextField(verbose_name='запрос')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='раз')),
+                ('total_ms', models.FloatField(default=0, verbose_name='всего, мс')),
+                ('max_ms', models.FloatField(default=0, verbose_name='максимум, мс')),
+                ('rows', models.IntegerField(blank=True, null=True, verbose_name='строк')),
+                ('view_name', models.CharField(blank=True, max_length=100, verbose_name='страница')),
+                ('stack', models.TextField(blank=True, verbose_name='откуда')),
+                ('last_seen', models.DateTimeField(auto_now=True, verbose_name='последний раз')),
+            ],
+            options={
+                'verbose_name': 'медленный запрос',
+                'verbose_name_plural': 'медленные запросы',
+                'ordering': ('-total_ms',),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='slowquery',
+            name='rows',
+            field=models.IntegerField(blank=True, help_text='Только для INSERT, UPDATE и DELETE.', null=True, verbose_name='строк изменено'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import models
+
+
+class SlowQuery(models.Model):
+    '''Queries of one shape that ran over SLOW_QUERY_THRESHOLD_MS.'''
+    fingerprint = models.CharField(
+        max_length=40,
+        unique=True,
+        verbose_name='отпечаток',
+    )
+    sql = models.TextField(verbose_name='запрос')
+    count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='раз',
+    )
+    total_ms = models.FloatField(
+        default=0,
+        verbose_name='всего, мс',
+    )
+    max_ms = models.FloatField(
+        default=0,
+        verbose_name='максимум, мс',
+    )
+    rows = models.IntegerField(
+        null=True,
+        blank=True,
+        verbose_name='строк изменено',
+        help_text='Только для INSERT, UPDATE и DELETE.',
+    )
+    view_name = models.CharField(
+        max_length=100,
+        blank=True,
+        verbose_name='страница',
+    )
+    stack = models.TextField(
+        blank=True,
+        verbose_name='откуда',
+    )
+    last_seen = models.DateTimeField(
+        auto_now=True,
+        verbose_name='последний раз',
+    )
+
+    class Meta:
+        ordering = ('-total_ms',)
+        verbose_name = 'медленный запрос'
+        verbose_name_plural = 'медленные запросы'
+
+    def __str__(self):
+        return self.sql[:50]
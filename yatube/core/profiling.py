@@ -0,0 +1,119 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from sorl.thumbnail.base import ThumbnailBackend
+
+# Phase names as they appear in the Server-Timing header.
+PHASES = ('db', 'tpl', 'thumb', 'app')
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+class Profile:
+    '''Time spent in each phase of one request.
+
+    Phases nest, a query run while a template renders counts as db
+    only. Whatever is not spent in a phase is Python time, "app".
+    '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.total = 0.0
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.stack = []
+
+    def enter(self):
+        self.stack.append([time.perf_counter(), 0.0])
+
+    def leave(self, name):
+        start, nested = self.stack.pop()
+        took = time.perf_counter() - start
+        self.times[name] += took - nested
+        if self.stack:
+            self.stack[-1][1] += took
+
+    def finish(self):
+        self.total = time.perf_counter() - self.start
+        self.times['app'] = self.total - sum(
+            took for name, took in self.times.items() if name != 'app'
+        )
+
+    def header(self):
+        '''Value of the Server-Timing header, durations in milliseconds.'''
+        parts = [
+            f'{name};dur={took * 1000:.1f}'
+            for name, took in self.times.items()
+        ]
+        parts[0] += f';desc="{self.queries} queries"'
+        parts.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(parts)
+
+    def log_line(self):
+        return ' '.join(
+            [f'total={self.total * 1000:.1f}ms']
+            + [f'{name}={took * 1000:.1f}ms'
+               for name, took in self.times.items()]
+            + [f'queries={self.queries}']
+        )
+
+
+@contextmanager
+def phase(name):
+    '''Attributes the time spent inside to a phase of the current request.'''
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    profile.enter()
+    try:
+        yield
+    finally:
+        profile.leave(name)
+
+
+def time_query(execute, sql, params, many, context):
+    '''Execute wrapper that times queries of the current request.'''
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    profile.queries += 1
+    profile.enter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.leave('db')
+
+
+class ProfiledTemplate(Template):
+    def render(self, context=None, request=None):
+        with phase('tpl'):
+            return super().render(context, request)
+
+
+class ProfiledTemplates(DjangoTemplates):
+    '''Django template backend that times rendering for Server-Timing.'''
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return ProfiledTemplate(
+                self.engine.get_template(template_name), self
+            )
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class ProfiledThumbnailBackend(ThumbnailBackend):
+    '''sorl backend that times thumbnail lookups and rendering.'''
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        with phase('thumb'):
+            return super().get_thumbnail(file_, geometry_string, **options)
@@ -0,0 +1,45 @@
+import re
+from collections import Counter
+
+from django.conf import settings
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def query_shape(sql):
+    '''SQL with parameter lists collapsed, equal for queries of one kind.'''
+    return IN_LIST.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    '''Execute wrapper that counts queries and their shapes.'''
+
+    def __init__(self):
+        self.count = 0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.shapes[query_shape(sql)] += 1
+        return execute(sql, params, many, context)
+
+    def repeated(self):
+        '''Shapes run often enough to look like an N+1 pattern.'''
+        return {
+            shape: times for shape, times in self.shapes.items()
+            if times > settings.QUERY_REPEAT_LIMIT
+        }
+
+
+def budget_problems(view_name, recorder, require_budget=True):
+    '''Describes how the queries of one request broke the view's budget.'''
+    budget = settings.QUERY_BUDGETS.get(view_name)
+    problems = []
+    if budget is None:
+        if require_budget:
+            problems.append('no query budget declared')
+    elif recorder.count > budget:
+        problems.append(f'{recorder.count} queries, budget is {budget}')
+    for shape, times in recorder.repeated().items():
+        problems.append(f'possible N+1, {times} x {shape}')
+    return problems
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.template.base import Node
+
+from core.models import SlowQuery
+from core.query_budget import query_shape
+
+logger = logging.getLogger(__name__)
+
+# Frames of the instrumentation itself say nothing about the caller.
+SKIPPED_FILES = {
+    __file__, os.path.join(os.path.dirname(__file__), 'middleware.py')
+}
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SPACE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    '''SQL with parameter lists, literals and spacing collapsed.'''
+    return SPACE.sub(' ', LITERAL.sub('?', query_shape(sql))).strip()
+
+
+def call_site(frame):
+    '''Template line and project frames that led to a query.
+
+    Library frames are skipped, the innermost template node comes first.
+    '''
+    lines = []
+    template = None
+    while frame is not None and len(lines) < settings.SLOW_QUERY_STACK_DEPTH:
+        code = frame.f_code
+        node = frame.f_locals.get('self')
+        if (
+            template is None and code.co_name == 'render_annotated'
+            and isinstance(node, Node) and getattr(node, 'token', None)
+        ):
+            template = f'{node.origin.template_name}:{node.token.lineno}'
+        elif (
+            code.co_filename.startswith(settings.BASE_DIR)
+            and code.co_filename not in SKIPPED_FILES
+            and 'site-packages' not in code.co_filename
+        ):
+            path = os.path.relpath(code.co_filename, settings.BASE_DIR)
+            lines.append(f'{path}:{frame.f_lineno} in {code.co_name}')
+        frame = frame.f_back
+    if template is not None:
+        lines.insert(0, f'template {template}')
+    return lines
+
+
+class SlowQueryLog:
+    '''Execute wrapper that keeps queries slower than the threshold.
+
+    A share of them, SLOW_QUERY_SAMPLE_RATE, is recorded with its call
+    site. Records are logged right away and saved by flush(), outside
+    the request's own queries. "rows" is only filled for writes: rows of
+    a SELECT are fetched after the wrapper returns, and SQLite reports
+    rowcount -1 for it.
+    '''
+
+    def __init__(self, request=None):
+        self.request = request
+        self.records = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            took = (time.perf_counter() - start) * 1000
+            if (
+                took >= settings.SLOW_QUERY_THRESHOLD_MS
+                and random.random() < settings.SLOW_QUERY_SAMPLE_RATE
+            ):
+                self.add(sql, took, context['cursor'].rowcount)
+
+    def add(self, sql, took, rows):
+        match = self.request and self.request.resolver_match
+        record = {
+            'sql': normalize(sql),
+            'ms': round(took, 3),
+            'rows': rows if rows >= 0 else None,
+            'view': match.view_name if match else '',
+            'stack': call_site(sys._getframe(2)),
+        }
+        self.records.append(record)
+        logger.warning(json.dumps(record, ensure_ascii=False))
+
+    def flush(self):
+        '''Adds the records to the per-shape totals shown in the admin.'''
+        records, self.records = self.records, []
+        try:
+            for record in records:
+                save(record)
+        except DatabaseError as error:
+            logger.error('Slow queries not saved: %s', error)
+
+
+def save(record):
+    fingerprint = hashlib.sha1(record['sql'].encode()).hexdigest()
+    details = {
+        'rows': record['rows'],
+        'view_name': record['view'][:100],
+        'stack': '\n'.join(record['stack']),
+    }
+    updated = SlowQuery.objects.filter(fingerprint=fingerprint).update(
+        count=F('count') + 1,
+        total_ms=F('total_ms') + record['ms'],
+        max_ms=Greatest(F('max_ms'), record['ms']),
+        **details,
+    )
+    if not updated:
+        SlowQuery.objects.get_or_create(
+            fingerprint=fingerprint,
+            defaults={
+                'sql': record['sql'],
+                'count': 1,
+                'total_ms': record['ms'],
+                'max_ms': record['ms'],
+                **details,
+            },
+        )
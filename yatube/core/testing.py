@@ -0,0 +1,19 @@
+from django.db import connection
+
+from core.query_budget import QueryRecorder, budget_problems
+
+
+class QueryBudgetMixin:
+    '''TestCase mixin that checks views against settings.QUERY_BUDGETS.'''
+
+    def assertWithinQueryBudget(self, view_name, client, url, data=None):
+        '''GETs `url`, or POSTs `data` to it, within the view's budget.'''
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            if data is None:
+                response = client.get(url)
+            else:
+                response = client.post(url, data)
+        problems = budget_problems(view_name, recorder)
+        self.assertFalse(problems, f'{view_name} ({url}): {problems}')
+        return response
@@ -0,0 +1,43 @@
+import math
+
+
+def percentile(values, fraction):
+    '''Nearest-rank percentile of already sorted values.'''
+    if not values:
+        return None
+    rank = max(math.ceil(fraction * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(durations):
+    '''Latency summary in milliseconds of durations given in seconds.'''
+    values = sorted(duration * 1000 for duration in durations)
+    if not values:
+        return {}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values), 3),
+        'p50_ms': round(percentile(values, 0.50), 3),
+        'p95_ms': round(percentile(values, 0.95), 3),
+        'p99_ms': round(percentile(values, 0.99), 3),
+        'max_ms': round(values[-1], 3),
+    }
+
+
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def histogram(durations, bounds=HISTOGRAM_BOUNDS_MS):
+    '''Counts of durations (seconds) per upper bound in milliseconds.
+
+    The last bucket, keyed None, holds everything above the last bound.
+    '''
+    counts = dict.fromkeys(bounds, 0)
+    counts[None] = 0
+    for duration in durations:
+        milliseconds = duration * 1000
+        bucket = next(
+            (bound for bound in bounds if milliseconds <= bound), None
+        )
+        counts[bucket] += 1
+    return counts
@@ -1,5 +1,11 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 
+from core.metrics import exposition, registry
+
 
 def page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path}, status=404)
@@ -11,3 +17,26 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+def has_metrics_token(request):
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(
+        header.encode(), f'Bearer {token}'.encode()
+    )
+
+
+def metrics(request):
+    '''Counters of all worker processes for Prometheus.
+
+    Only scrapers with METRICS_TOKEN and staff may read them, others get
+    a 404.
+    '''
+    if not (has_metrics_token(request) or request.user.is_staff):
+        raise Http404
+    registry.flush(force=True)
+    return HttpResponse(
+        exposition(registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
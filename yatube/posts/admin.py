@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from posts.models import Post, Group, Follow, Comment
+from posts.search import filter_posts
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -16,6 +17,11 @@ class PostAdmin(admin.ModelAdmin):
     list_editable = ('group',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return filter_posts(queryset, search_term), False
+
 
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('pk', 'post', 'author', 'text', 'created')
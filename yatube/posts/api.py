@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import (
+    get_conditional_response, patch_vary_headers, quote_etag
+)
+from django.views.decorators.http import require_GET
+
+from posts.models import Group, Post, User
+from posts.timeline import FollowFeed, FollowPaginator
+from posts.utils import (
+    CursorPaginator, count_key, feed_etag, feed_version, make_etag
+)
+
+FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+}
+CURSOR_FIELDS = ('id', 'pub_date')
+
+
+def parse_fields(request):
+    '''Fields requested by ?fields=, all of them by default.'''
+    value = request.GET.get('fields')
+    if not value:
+        return list(FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}.')
+    return fields
+
+
+def serialize(row, fields):
+    image_storage = Post._meta.get_field('image').storage
+    data = {field: row[FIELDS[field]] for field in fields}
+    if data.get('image'):
+        data['image'] = image_storage.url(data['image'])
+    elif 'image' in data:
+        data['image'] = None
+    return data
+
+
+def post_row(post):
+    '''Post as the row feed_response selects with values().'''
+    return {
+        'id': post.pk,
+        'text': post.text,
+        'pub_date': post.pub_date,
+        'author__username': post.author.username,
+        'group__slug': post.group.slug if post.group_id else None,
+        'image': post.image.name,
+    }
+
+
+def page_response(page, rows, fields):
+    return JsonResponse({
+        'results': [serialize(row, fields) for row in rows],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+def feed_response(request, posts, count_key=None, *vary_on):
+    '''Page of a feed as JSON, or 304 when the client's copy is current.
+
+    The ETag costs one aggregate query, nothing is selected or
+    serialized for unchanged feeds.
+    '''
+    try:
+        fields = parse_fields(request)
+    except ValueError as error:
+        return JsonResponse({'detail': str(error)}, status=400)
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    etag = quote_etag(feed_etag(
+        posts, count_key, ','.join(fields), after, before, *vary_on
+    ))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        lookups = {FIELDS[field] for field in fields} | set(CURSOR_FIELDS)
+        paginator = CursorPaginator(posts.values(*lookups), settings.MAX_POSTS)
+        page = paginator.cursor_page(after=after, before=before)
+        response = page_response(page, page, fields)
+    response['ETag'] = etag
+    return response
+
+
+@require_GET
+def index(request):
+    return feed_response(request, Post.objects.all(), count_key('index'))
+
+
+@require_GET
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return feed_response(
+        request, group.posts.all(), count_key('group', group.pk)
+    )
+
+
+@require_GET
+def profile(request, username):
+    author = get_object_or_404(User, username=username)
+    return feed_response(
+        request, author.posts.all(), count_key('author', author.pk)
+    )
+
+
+@require_GET
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return JsonResponse(
+            {'detail': 'Authentication required.'}, status=401
+        )
+    try:
+        fields = parse_fields(request)
+    except ValueError as error:
+        return JsonResponse({'detail': str(error)}, status=400)
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    feed = FollowFeed(request.user)
+    etag = quote_etag(make_etag(
+        feed.latest(), feed.count(), feed_version(), request.user.pk,
+        ','.join(fields), after, before,
+    ))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        paginator = FollowPaginator(feed, settings.MAX_POSTS)
+        page = paginator.cursor_page(after=after, before=before)
+        response = page_response(
+            page, [post_row(post) for post in page], fields
+        )
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Cookie',))
+    return response
@@ -0,0 +1,12 @@
+from django.urls import path
+
+from posts import api
+
+app_name = 'api'
+
+urlpatterns = [
+    path('posts/', api.index, name='index'),
+    path('groups/<slug:slug>/posts/', api.group_posts, name='group_list'),
+    path('profiles/<str:username>/posts/', api.profile, name='profile'),
+    path('follow/posts/', api.follow_index, name='follow_index'),
+]
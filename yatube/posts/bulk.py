@@ -0,0 +1,47 @@
+from itertools import islice
+
+from django.core.cache import cache
+from django.core.management import call_command
+
+
+def batched(objects, size):
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, size))
+        if not batch:
+            return
+        yield batch
+
+
+def auto_now_add_fields(model):
+    return [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now_add', False)
+    ]
+
+
+def insert_keeping_dates(model, objects, **kwargs):
+    '''bulk_create that keeps preset values of auto_now_add fields.
+
+    bulk_create stamps those fields with the current time, so the preset
+    values are written back with bulk_update. Objects need primary keys.
+    '''
+    fields = auto_now_add_fields(model)
+    preset = [
+        [getattr(obj, field.attname) for field in fields] for obj in objects
+    ]
+    model.objects.bulk_create(objects, **kwargs)
+    if not fields or not objects:
+        return
+    for obj, values in zip(objects, preset):
+        for field, value in zip(fields, values):
+            setattr(obj, field.attname, value)
+    model.objects.bulk_update(objects, [field.name for field in fields])
+
+
+def sync_denormalized(stdout, timelines=True):
+    '''Brings counters, timelines and caches in line with bulk inserts.'''
+    call_command('recount', stdout=stdout)
+    if timelines:
+        call_command('rebuild_timelines', stdout=stdout)
+    cache.clear()
@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from posts.images import normalize
 from posts.models import Post, Comment
 
 
@@ -14,6 +16,12 @@ class PostForm(forms.ModelForm):
             raise forms.ValidationError('Это поле обязательно для заполнения')
         return data
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            return normalize(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
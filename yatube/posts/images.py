@@ -0,0 +1,219 @@
+import logging
+import os
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import transaction
+from django.db.models import Count, F
+from PIL import Image, ImageOps
+
+from posts.models import Post, StoredImage
+
+logger = logging.getLogger(__name__)
+
+# Colour space signatures of ICC profiles, by the image mode they fit.
+PROFILE_SPACES = {
+    'RGB': b'RGB ', 'RGBA': b'RGB ', 'P': b'RGB ', 'L': b'GRAY', 'LA': b'GRAY',
+}
+ORIENTATION = 0x0112
+# JPEG segments that describe the pixels: APP0 JFIF, APP2 ICC profile and
+# APP14 Adobe colour transform. Other APPn and COM segments are metadata.
+JPEG_KEPT_SEGMENTS = {0xE0, 0xE2, 0xEE}
+PNG_METADATA_CHUNKS = {b'tEXt', b'zTXt', b'iTXt', b'eXIf', b'tIME'}
+SAVED_FORMATS = {'JPEG': ('jpg', 'image/jpeg'), 'PNG': ('png', 'image/png')}
+
+
+def has_alpha(image):
+    '''Whether any pixel of the image is not fully opaque.'''
+    if image.mode == 'P':
+        return 'transparency' in image.info
+    if image.mode not in ('RGBA', 'LA'):
+        return False
+    return image.getchannel('A').getextrema()[0] < 255
+
+
+def profile_for(icc_profile, mode):
+    '''The source colour profile if it describes images of `mode`.
+
+    Bytes 16-20 of a profile name its colour space. A CMYK profile is
+    wrong for the RGB copy of a CMYK image and is dropped.
+    '''
+    if icc_profile and icc_profile[16:20] == PROFILE_SPACES.get(mode):
+        return icc_profile
+    return None
+
+
+def strip_jpeg(data):
+    '''JPEG bytes without EXIF, XMP, IPTC and comment segments.'''
+    parts = [data[:2]]
+    position = 2
+    while data[position:position + 1] == b'\xff':
+        marker = data[position + 1]
+        if marker == 0xDA:
+            break
+        end = position + 2 + int.from_bytes(
+            data[position + 2:position + 4], 'big'
+        )
+        if not (0xE0 <= marker <= 0xEF or marker == 0xFE) or (
+            marker in JPEG_KEPT_SEGMENTS
+        ):
+            parts.append(data[position:end])
+        position = end
+    parts.append(data[position:])
+    return b''.join(parts)
+
+
+def strip_png(data):
+    '''PNG bytes without text, EXIF and timestamp chunks.'''
+    parts = [data[:8]]
+    position = 8
+    while position < len(data):
+        end = position + 12 + int.from_bytes(
+            data[position:position + 4], 'big'
+        )
+        if data[position + 4:position + 8] not in PNG_METADATA_CHUNKS:
+            parts.append(data[position:end])
+        position = end
+    return b''.join(parts)
+
+
+def encode(image, icc_profile):
+    '''Progressive JPEG of an opaque image, optimized PNG of the rest.'''
+    output = BytesIO()
+    if has_alpha(image):
+        image.save(
+            output, 'PNG', optimize=True,
+            icc_profile=profile_for(icc_profile, image.mode),
+        )
+        return output.getvalue(), 'PNG'
+    image.convert('RGB').save(
+        output, 'JPEG', quality=settings.IMAGE_JPEG_QUALITY,
+        optimize=True, progressive=True,
+        icc_profile=profile_for(icc_profile, 'RGB'),
+    )
+    return output.getvalue(), 'JPEG'
+
+
+def normalize(upload):
+    '''Uploaded image turned upright, capped in size and stripped of EXIF.
+
+    Opaque images are re-encoded as progressive JPEG, transparent ones as
+    optimized PNG. A JPEG or PNG that needs no turning or shrinking keeps
+    its own bytes, minus metadata segments, when that is not larger than
+    the re-encoded copy. GIFs are returned untouched so animations
+    survive. The colour profile is kept when it still fits the saved
+    pixels, it is not metadata about the author.
+    '''
+    start = time.perf_counter()
+    upload.seek(0)
+    data = upload.read()
+    try:
+        image = Image.open(BytesIO(data))
+        if image.format == 'GIF':
+            upload.seek(0)
+            return upload
+        source_format, source_size = image.format, image.size
+        limit = settings.IMAGE_MAX_SIZE
+        image.draft('RGB', (limit, limit))
+        icc_profile = image.info.get('icc_profile')
+        upright = image.getexif().get(ORIENTATION, 1) == 1
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((limit, limit), Image.LANCZOS)
+        content, image_format = encode(image, icc_profile)
+    except (OSError, Image.DecompressionBombError) as error:
+        logger.info('%s: unreadable image: %s', upload.name, error)
+        raise ValidationError(
+            'Загрузите правильное изображение. Файл, который вы загрузили, '
+            'поврежден или не является изображением.',
+            code='invalid_image',
+        )
+    if (
+        source_format in SAVED_FORMATS and upright
+        and image.size == source_size and image.mode in PROFILE_SPACES
+        and profile_for(icc_profile, image.mode) == icc_profile
+    ):
+        strip = strip_jpeg if source_format == 'JPEG' else strip_png
+        stripped = strip(data)
+        if len(stripped) <= len(content):
+            content, image_format = stripped, source_format
+    extension, content_type = SAVED_FORMATS[image_format]
+    size = len(content)
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+    logger.info(
+        '%s: %d -> %d bytes, %d saved, %dx%d, %.1f ms',
+        upload.name, upload.size, size, upload.size - size,
+        *image.size, (time.perf_counter() - start) * 1000,
+    )
+    return InMemoryUploadedFile(
+        BytesIO(content), 'image', f'{name}.{extension}', content_type,
+        size, None,
+    )
+
+
+def retain(name):
+    '''Counts one more post referring to a stored image.
+
+    Runs in the transaction of the post save, a failure rolls both back.
+    '''
+    if not name:
+        return
+    with transaction.atomic(savepoint=False):
+        images = StoredImage.objects.filter(name=name)
+        if images.update(refs=F('refs') + 1):
+            return
+        StoredImage.objects.bulk_create(
+            [StoredImage(name=name)], ignore_conflicts=True
+        )
+        images.update(refs=F('refs') + 1)
+
+
+def release(name):
+    '''Counts one post less and removes the file once nothing refers to it.
+
+    The file goes away after the transaction commits, unless it was
+    uploaded again in the meantime. Images without a counter are kept.
+    '''
+    if not name:
+        return
+    with transaction.atomic(savepoint=False):
+        images = StoredImage.objects.filter(name=name)
+        images.filter(refs__gt=0).update(refs=F('refs') - 1)
+        deleted, _ = images.filter(refs=0).delete()
+    if deleted:
+        transaction.on_commit(lambda: purge(name))
+
+
+def purge(name):
+    '''Deletes an unreferenced image file along with its thumbnails.
+
+    Runs after commit, so failures are only logged.
+    '''
+    from sorl.thumbnail import default
+    from sorl.thumbnail.images import ImageFile
+
+    if StoredImage.objects.filter(name=name).exists():
+        return
+    storage = Post._meta.get_field('image').storage
+    try:
+        default.kvstore.delete(ImageFile(name, storage))
+        storage.delete(name)
+    except (OSError, SuspiciousFileOperation) as error:
+        logger.warning('%s: could not delete: %s', name, error)
+        return
+    logger.info('%s: no longer used, deleted', name)
+
+
+def recount():
+    '''Recomputes every image counter from the posts table.'''
+    images = Post.objects.exclude(image='').order_by().values_list(
+        'image'
+    ).annotate(total=Count('pk'))
+    with transaction.atomic():
+        StoredImage.objects.all().delete()
+        StoredImage.objects.bulk_create(
+            (StoredImage(name=name, refs=total) for name, total in images),
+            batch_size=500,
+        )
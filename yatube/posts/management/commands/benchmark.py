@@ -0,0 +1,213 @@
+import json
+import platform
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from core.query_budget import QueryRecorder
+from core.timing import summarize
+from posts.models import AuthorStats, Comment, Follow, Group, Post
+from posts.seeding import Seeder
+from posts.urls import urlpatterns
+
+User = get_user_model()
+
+# These views write on GET, timing them would change an --existing database.
+SKIPPED_ROUTES = ('posts:profile_follow', 'posts:profile_unfollow')
+
+
+def regressions(results, baseline, tolerance):
+    '''Routes slower or chattier than in the baseline run.'''
+    found = []
+    for view_name, result in results['routes'].items():
+        before = baseline.get('routes', {}).get(view_name)
+        if not before:
+            continue
+        limit = before['p95_ms'] * (1 + tolerance)
+        if result['p95_ms'] > limit:
+            found.append(
+                f'{view_name}: p95 {result["p95_ms"]:.2f} ms, '
+                f'baseline {before["p95_ms"]:.2f} ms'
+            )
+        if result['queries'] > before['queries']:
+            found.append(
+                f'{view_name}: {result["queries"]} queries, '
+                f'baseline {before["queries"]}'
+            )
+    return found
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a throwaway database and times every posts route: '
+        'p50/p95/p99 latency, queries per request and peak memory.'
+    )
+
+    def add_arguments(self, parser):
+        for name, default in (
+            ('users', 1000), ('groups', 20), ('posts', 20000),
+            ('comments', 20000), ('follows', 20000),
+        ):
+            parser.add_argument(
+                f'--{name}', type=int, default=default,
+                help=f'Number of {name} to seed, {default} by default.',
+            )
+        parser.add_argument(
+            '--existing', action='store_true',
+            help=(
+                'Benchmark the configured database as is, without seeding. '
+                'Fill it once with seed_data to reuse the same data.'
+            ),
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help='Timed requests per route.',
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=3,
+            help='Untimed requests per route before timing.',
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Clear the cache before every request.',
+        )
+        parser.add_argument(
+            '--route', action='append', dest='routes', default=[],
+            help='Only run this route, e.g. posts:index. May be repeated.',
+        )
+        parser.add_argument('--output', help='Write results to this file.')
+        parser.add_argument(
+            '--baseline', help='Compare results with this earlier output.',
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Allowed p95 slowdown against the baseline, 0.2 is 20%%.',
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+        if options['existing']:
+            results = self.run(options)
+        else:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                Seeder(stdout=self.stdout).seed(
+                    options['users'], options['groups'], options['posts'],
+                    options['comments'], options['follows'],
+                )
+                results = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2, ensure_ascii=False)
+        if baseline is not None:
+            found = regressions(results, baseline, options['tolerance'])
+            if found:
+                raise CommandError(
+                    'Slower than the baseline:\n' + '\n'.join(found)
+                )
+            self.stdout.write(self.style.SUCCESS('No regressions.'))
+
+    def routes(self):
+        '''URL of every posts route, filled with the busiest rows.'''
+        author = AuthorStats.objects.select_related('user').order_by(
+            '-posts_count'
+        ).first()
+        reader = Follow.objects.values_list('user', flat=True).first()
+        post = author and Post.objects.filter(author_id=author.pk).first()
+        group = Group.objects.order_by('pk').first()
+        if None in (post, group, reader):
+            raise CommandError('Nothing to benchmark, seed the database.')
+        values = {
+            'username': author.user.username,
+            'post_id': post.pk,
+            'slug': group.slug,
+        }
+        routes = {}
+        for pattern in urlpatterns:
+            if f'posts:{pattern.name}' in SKIPPED_ROUTES:
+                continue
+            kwargs = {
+                name: values[name] for name in pattern.pattern.converters
+            }
+            routes[f'posts:{pattern.name}'] = reverse(
+                f'posts:{pattern.name}', kwargs=kwargs
+            )
+        routes['posts:search'] += '?q=' + post.text.split()[0].strip('.,')
+        return User.objects.get(pk=reader), routes
+
+    def measure(self, client, url, options):
+        durations = []
+        queries = 0
+        statuses = set()
+        for attempt in range(options['warmup'] + options['repeat']):
+            if options['cold']:
+                cache.clear()
+            recorder = QueryRecorder()
+            start = time.perf_counter()
+            with connection.execute_wrapper(recorder):
+                response = client.get(url)
+            took = time.perf_counter() - start
+            if attempt >= options['warmup']:
+                durations.append(took)
+                queries = max(queries, recorder.count)
+                statuses.add(response.status_code)
+        tracemalloc.start()
+        client.get(url)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {
+            'url': url,
+            **summarize(durations),
+            'queries': queries,
+            'peak_kb': round(peak / 1024, 1),
+            'statuses': sorted(statuses),
+        }
+
+    def run(self, options):
+        user, routes = self.routes()
+        client = Client()
+        client.force_login(user)
+        results = {
+            'meta': {
+                'date': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'vendor': connection.vendor,
+                'repeat': options['repeat'],
+                'cold': options['cold'],
+                'rows': {
+                    model.__name__: model.objects.count()
+                    for model in (User, Group, Post, Comment, Follow)
+                },
+            },
+            'routes': {},
+        }
+        self.stdout.write(
+            f'{"route":<24}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"queries":>9}{"peak KB":>10}'
+        )
+        for view_name, url in routes.items():
+            if options['routes'] and view_name not in options['routes']:
+                continue
+            result = self.measure(client, url, options)
+            results['routes'][view_name] = result
+            self.stdout.write(
+                f'{view_name:<24}{result["p50_ms"]:>9.2f}'
+                f'{result["p95_ms"]:>9.2f}{result["p99_ms"]:>9.2f}'
+                f'{result["queries"]:>9}{result["peak_kb"]:>10}'
+            )
+        return results
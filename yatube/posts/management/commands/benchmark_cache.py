@@ -0,0 +1,145 @@
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from core.timing import summarize
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'filebased': 'django.core.cache.backends.filebased.FileBasedCache',
+    'sqlite': 'core.cache.SQLiteCache',
+}
+OPERATIONS = ('set', 'get_hit', 'get_miss', 'set_many', 'get_many', 'incr')
+BATCH = 10
+# Room for every key of a run, so culling does not skew the timings.
+MAX_ENTRIES = 10 ** 7
+
+
+class Command(BaseCommand):
+    help = (
+        'Times cache operations of the local memory, file based and SQLite '
+        'backends from a pool of threads and checks incr for lost updates.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ops', type=int, default=1000,
+            help=(
+                'Calls of every operation, split between the threads. '
+                'The file based backend lists its directory on every '
+                'write, keep this low for it.'
+            ),
+        )
+        parser.add_argument(
+            '--threads', type=int, default=4,
+            help='Number of concurrent clients.',
+        )
+        parser.add_argument(
+            '--value-size', type=int, default=2048,
+            help='Size of cached values in bytes.',
+        )
+        parser.add_argument(
+            '--backend', action='append', dest='backends', default=[],
+            help=f'Only run this backend, one of {", ".join(BACKENDS)}.',
+        )
+        parser.add_argument('--output', help='Write results to this file.')
+
+    def handle(self, *args, **options):
+        names = options['backends'] or list(BACKENDS)
+        unknown = set(names) - set(BACKENDS)
+        if unknown:
+            raise CommandError(f'Unknown backends: {", ".join(unknown)}')
+        results = {}
+        self.stdout.write(
+            f'{"backend":<11}{"operation":<10}{"ops/s":>10}'
+            f'{"p50":>9}{"p99":>9}'
+        )
+        for name in names:
+            with tempfile.TemporaryDirectory() as directory:
+                cache = self.create(name, directory)
+                try:
+                    results[name] = self.run(cache, options)
+                finally:
+                    cache.close()
+            for operation, result in results[name].items():
+                if operation == 'lost_increments':
+                    continue
+                self.stdout.write(
+                    f'{name:<11}{operation:<10}{result["ops_per_s"]:>10}'
+                    f'{result["p50_ms"]:>9.3f}{result["p99_ms"]:>9.3f}'
+                )
+            lost = results[name]['lost_increments']
+            if lost:
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: {lost} of {options["ops"]} increments lost'
+                ))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+    def create(self, name, directory):
+        location = directory
+        if name == 'sqlite':
+            location = os.path.join(directory, 'cache.sqlite3')
+        return import_string(BACKENDS[name])(location, {
+            'TIMEOUT': None,
+            'OPTIONS': {'MAX_ENTRIES': MAX_ENTRIES},
+        })
+
+    def operation(self, cache, operation, value, number):
+        if operation == 'set':
+            cache.set(f'key:{number}', value)
+        elif operation == 'get_hit':
+            cache.get(f'key:{number}')
+        elif operation == 'get_miss':
+            cache.get(f'missing:{number}')
+        elif operation == 'set_many':
+            cache.set_many({
+                f'many:{number}:{i}': value for i in range(BATCH)
+            })
+        elif operation == 'get_many':
+            cache.get_many(
+                [f'many:{number}:{i}' for i in range(BATCH)]
+            )
+        else:
+            cache.incr('counter')
+
+    def worker(self, cache, operation, value, numbers):
+        durations = []
+        for number in numbers:
+            start = time.perf_counter()
+            self.operation(cache, operation, value, number)
+            durations.append(time.perf_counter() - start)
+        return durations
+
+    def run(self, cache, options):
+        value = os.urandom(options['value_size'])
+        threads = options['threads']
+        ops = options['ops']
+        cache.set('counter', 0)
+        results = {}
+        for operation in OPERATIONS:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                futures = [
+                    pool.submit(
+                        self.worker, cache, operation, value,
+                        range(offset, ops, threads),
+                    )
+                    for offset in range(threads)
+                ]
+                durations = [
+                    took for future in futures for took in future.result()
+                ]
+            elapsed = time.perf_counter() - start
+            results[operation] = {
+                'ops_per_s': round(len(durations) / elapsed),
+                **summarize(durations),
+            }
+        results['lost_increments'] = ops - cache.get('counter')
+        return results
@@ -0,0 +1,58 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import User
+from posts.ndjson import MODELS, author_querysets, dump, gzipped
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams posts, comments and follows as newline-delimited JSON '
+        'without loading the dataset into memory.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='model',
+            help=f'Models to export: {", ".join(MODELS)}. All by default.',
+        )
+        parser.add_argument(
+            '--output', '-o',
+            help='File to write to, standard output by default.',
+        )
+        parser.add_argument(
+            '--gzip', action='store_true', help='Compress the output.',
+        )
+        parser.add_argument(
+            '--author',
+            help='Only rows of this author, like the profile export page.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Rows fetched from the database at a time.',
+        )
+
+    def handle(self, *args, **options):
+        names = options['models'] or list(MODELS)
+        unknown = set(names) - set(MODELS)
+        if unknown:
+            raise CommandError(f'Unknown models: {", ".join(unknown)}.')
+        querysets = {name: MODELS[name].objects.all() for name in names}
+        if options['author']:
+            author = User.objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(f'No user {options["author"]}.')
+            querysets = author_querysets(author, names)
+        chunks = dump(querysets, options['chunk_size'])
+        if options['gzip']:
+            chunks = gzipped(chunks)
+        if options['output']:
+            with open(options['output'], 'wb') as file:
+                file.writelines(chunks)
+        elif options['gzip']:
+            sys.stdout.buffer.writelines(chunks)
+            sys.stdout.buffer.flush()
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
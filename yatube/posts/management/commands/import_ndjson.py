@@ -0,0 +1,51 @@
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from posts.bulk import sync_denormalized
+from posts.ndjson import load
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def open_stream(path):
+    '''Binary stream of a file or stdin, unpacked if it is gzipped.'''
+    stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.open(stream)
+    return stream
+
+
+class Command(BaseCommand):
+    help = (
+        'Loads newline-delimited JSON written by export_ndjson in batches '
+        'of bulk inserts. Existing rows are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='File to read, plain or gzipped. - reads stdin.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Rows per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            stream = open_stream(options['path'])
+        except OSError as error:
+            raise CommandError(error)
+        with stream:
+            try:
+                counts = load(stream, options['batch_size'])
+            except (ValueError, TypeError) as error:
+                raise CommandError(f'Broken record: {error}')
+            except IntegrityError as error:
+                raise CommandError(f'Record refers to a missing row: {error}')
+        sync_denormalized(self.stdout)
+        for name, count in counts.items():
+            self.stdout.write(f'{name}: {count} rows read')
+        self.stdout.write(self.style.SUCCESS('Done.'))
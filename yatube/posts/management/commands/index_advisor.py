@@ -0,0 +1,184 @@
+import re
+import statistics
+import time
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from posts.models import Follow, Group, Post
+
+User = get_user_model()
+
+SCANNED = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+FIRST_TABLE = re.compile(r' FROM "(\w+)"')
+EQUALS = re.compile(r'"(\w+)"\."(\w+)" (?:= |IN \()')
+ORDERED = re.compile(r'"(\w+)"\."(\w+)"( DESC)?')
+
+
+class SelectRecorder:
+    '''Execute wrapper that keeps SELECT statements with their params.'''
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def plan_problems(plan):
+    '''Plan steps that read a whole table or sort in a temp B-tree.'''
+    problems = []
+    for detail in plan:
+        if detail.startswith('SCAN') and 'INDEX' not in detail:
+            problems.append(f'full scan: {detail}')
+        elif 'USE TEMP B-TREE' in detail:
+            problems.append(f'sort: {detail}')
+    return problems
+
+
+def suggested_index(sql, plan):
+    '''(model, Meta.indexes entry) serving a flagged query, or None.
+
+    The index leads with the columns the query compares for equality and
+    ends with its ORDER BY columns, both taken from the scanned table.
+    '''
+    scanned = [m.group(1) for m in map(SCANNED.match, plan) if m]
+    first = FIRST_TABLE.search(sql)
+    table = scanned[0] if scanned else first and first.group(1)
+    model = next(
+        (m for m in apps.get_models() if m._meta.db_table == table), None
+    )
+    if model is None:
+        return None
+    where, _, order = sql.partition(' ORDER BY ')
+    keys = [
+        (column, '') for name, column
+        in EQUALS.findall(where.partition(' WHERE ')[2]) if name == table
+    ] + [
+        (column, '-' if desc else '') for name, column, desc
+        in ORDERED.findall(order) if name == table
+    ]
+    names = {field.column: field.name for field in model._meta.fields}
+    fields = {}
+    for column, sign in keys:
+        fields.setdefault(names.get(column, column), sign)
+    if not fields:
+        return None
+    name = '_'.join([model._meta.model_name, *fields])[:26] + '_idx'
+    entry = tuple(sign + field for field, sign in fields.items())
+    return model, f"models.Index(fields={entry!r}, name='{name}')"
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the posts views, explains the SQL they emit and reports '
+        'full table scans and temp B-tree sorts with their timings.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username',
+            help='User to log in as, by default a user who follows someone.',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='How many times each query is timed.',
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Time every query, not only the flagged ones.',
+        )
+
+    def routes(self, user):
+        post = Post.objects.order_by('-pub_date').first()
+        group = Group.objects.order_by('pk').first()
+        author = Follow.objects.filter(user=user).values_list(
+            'author__username', flat=True
+        ).first() or user.username
+        routes = {
+            'posts:index': reverse('posts:index'),
+            'posts:profile': reverse('posts:profile', args=(author,)),
+            'posts:follow_index': reverse('posts:follow_index'),
+        }
+        if group is not None:
+            routes['posts:group_list'] = reverse(
+                'posts:group_list', args=(group.slug,)
+            )
+        if post is not None:
+            routes['posts:post_detail'] = reverse(
+                'posts:post_detail', args=(post.pk,)
+            )
+        return routes
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def timing(self, sql, params, repeat):
+        durations = []
+        with connection.cursor() as cursor:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cursor.execute(sql, params)
+                cursor.fetchall()
+                durations.append(time.perf_counter() - start)
+        return statistics.median(durations) * 1000
+
+    def check_query(self, sql, params, options, suggestions):
+        '''Reports one query, True if its plan needs an index.'''
+        plan = self.explain(sql, params)
+        problems = plan_problems(plan)
+        if not problems and not options['all']:
+            return False
+        took = self.timing(sql, params, options['repeat'])
+        self.stdout.write(f'  {took:.2f} ms  {sql[:200]}')
+        for problem in problems:
+            self.stdout.write(self.style.WARNING(f'    {problem}'))
+        suggestion = problems and suggested_index(sql, plan)
+        if suggestion:
+            model, index = suggestion
+            suggestions.setdefault(model.__name__, set()).add(index)
+        return bool(problems)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN is only run on SQLite.')
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+        else:
+            user = User.objects.filter(follower__isnull=False).first()
+        if user is None:
+            raise CommandError('No user to log in as, seed the database.')
+        client = Client()
+        client.force_login(user)
+        flagged = 0
+        suggestions = {}
+        for view_name, url in self.routes(user).items():
+            recorder = SelectRecorder()
+            with connection.execute_wrapper(recorder):
+                client.get(url)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{view_name} {url}: {len(recorder.queries)} SELECTs'
+            ))
+            for sql, params in recorder.queries:
+                flagged += self.check_query(sql, params, options, suggestions)
+        if flagged:
+            self.stdout.write(self.style.WARNING(
+                f'{flagged} queries need an index. Add these to Meta.indexes '
+                'and run makemigrations:'
+            ))
+            for model_name, indexes in sorted(suggestions.items()):
+                self.stdout.write(f'  {model_name}:')
+                for index in sorted(indexes):
+                    self.stdout.write(f'    {index},')
+        else:
+            self.stdout.write(
+                self.style.SUCCESS('All feed queries use indexes.')
+            )
@@ -0,0 +1,324 @@
+import io
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from itertools import count
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+)
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import got_request_exception
+from django.db import connection
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from core.timing import HISTOGRAM_BOUNDS_MS, histogram, summarize
+from posts.models import Group, Post
+
+User = get_user_model()
+
+# name: (weight, logged in only)
+SCENARIOS = {
+    'index': (30, False),
+    'group': (10, False),
+    'profile': (10, False),
+    'post_detail': (20, False),
+    'comments': (5, False),
+    'search': (5, False),
+    'follow_index': (10, True),
+    'comment': (4, True),
+    'follow': (3, True),
+    'create': (3, True),
+}
+WRITES = ('comment', 'follow', 'create')
+
+
+class Identity:
+    '''Cookies of a visitor: a CSRF secret and a session if logged in.'''
+
+    def __init__(self, user=None):
+        self.user = user
+        self.csrf_token = get_random_string(32)
+        self.cookies = {settings.CSRF_COOKIE_NAME: self.csrf_token}
+        if user is not None:
+            session = import_module(settings.SESSION_ENGINE).SessionStore()
+            session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+            self.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def environ(self, method, path, data=None):
+        '''WSGI environ of a request made with this visitor's cookies.'''
+        query, body = '', b''
+        if method == 'GET' and data:
+            query = urlencode(data)
+        elif data:
+            body = urlencode(data).encode()
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'HTTP_COOKIE': '; '.join(
+                f'{name}={value}' for name, value in self.cookies.items()
+            ),
+            'HTTP_X_CSRFTOKEN': self.csrf_token,
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': io.StringIO(),
+        }
+        setup_testing_defaults(environ)
+        return environ
+
+
+class ErrorLog:
+    '''Counts exceptions raised by views, grouped by their message.'''
+
+    def __init__(self):
+        self.errors = Counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, sender, **kwargs):
+        error = sys.exc_info()[1]
+        message = f'{type(error).__name__}: {error}'[:120]
+        with self.lock:
+            self.errors[message] += 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Replays a mix of anonymous and logged-in traffic against the WSGI '
+        'application from a pool of threads and reports throughput, '
+        'latency histograms and errors. Writes go to the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help='Number of concurrent clients.',
+        )
+        parser.add_argument(
+            '--requests', type=int, default=1000,
+            help='Total number of requests to send.',
+        )
+        parser.add_argument(
+            '--duration', type=float,
+            help='Send requests for this many seconds instead.',
+        )
+        parser.add_argument(
+            '--users', type=int, default=20,
+            help='Number of users to log in as.',
+        )
+        parser.add_argument(
+            '--logged-in', type=float, default=0.3,
+            help='Share of public pages requested by logged-in users.',
+        )
+        parser.add_argument(
+            '--mix', action='append', default=[], metavar='NAME=WEIGHT',
+            help=(
+                f'Weight of a scenario, one of {", ".join(SCENARIOS)}. '
+                'A weight of 0 disables it.'
+            ),
+        )
+        parser.add_argument(
+            '--read-only', action='store_true',
+            help='Skip scenarios that write to the database.',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write results to this file.')
+
+    def weights(self, options):
+        weights = {name: weight for name, (weight, _) in SCENARIOS.items()}
+        for item in options['mix']:
+            name, _, weight = item.partition('=')
+            if name not in SCENARIOS or not weight.isdigit():
+                raise CommandError(f'Bad --mix value: {item}')
+            weights[name] = int(weight)
+        if options['read_only']:
+            for name in WRITES:
+                weights[name] = 0
+        weights = {name: weight for name, weight in weights.items() if weight}
+        if not weights:
+            raise CommandError('Every scenario is disabled.')
+        return weights
+
+    def load_samples(self, options):
+        users = list(
+            User.objects.filter(follower__isnull=False).distinct()[
+                :options['users']
+            ]
+        ) or list(User.objects.all()[:options['users']])
+        self.post_ids = list(
+            Post.objects.order_by('-pub_date').values_list('pk', flat=True)[
+                :1000
+            ]
+        )
+        self.usernames = list(
+            User.objects.filter(posts__isnull=False).distinct().values_list(
+                'username', flat=True
+            )[:1000]
+        )
+        self.groups = list(Group.objects.values_list('pk', 'slug')[:100])
+        if not (users and self.post_ids and self.groups):
+            raise CommandError('Nothing to load, seed the database.')
+        self.words = [
+            word for text in Post.objects.values_list('text', flat=True)[:50]
+            for word in text.split()[:3]
+        ]
+        self.members = [Identity(user) for user in users]
+
+    def request_for(self, name, rng):
+        '''Method, path and data of one request of a scenario.'''
+        if name == 'index':
+            return 'GET', reverse('posts:index'), {}
+        if name == 'group':
+            slug = rng.choice(self.groups)[1]
+            return 'GET', reverse('posts:group_list', args=(slug,)), {}
+        if name == 'profile':
+            username = rng.choice(self.usernames)
+            return 'GET', reverse('posts:profile', args=(username,)), {}
+        post_id = rng.choice(self.post_ids)
+        if name == 'post_detail':
+            return 'GET', reverse('posts:post_detail', args=(post_id,)), {}
+        if name == 'comments':
+            return 'GET', reverse('posts:comment_list', args=(post_id,)), {}
+        if name == 'search':
+            return 'GET', reverse('posts:search'), {
+                'q': rng.choice(self.words)
+            }
+        if name == 'follow_index':
+            return 'GET', reverse('posts:follow_index'), {}
+        if name == 'comment':
+            return 'POST', reverse('posts:add_comment', args=(post_id,)), {
+                'text': 'Комментарий нагрузочного теста'
+            }
+        if name == 'follow':
+            view = rng.choice(
+                ('posts:profile_follow', 'posts:profile_unfollow')
+            )
+            username = rng.choice(self.usernames)
+            return 'GET', reverse(view, args=(username,)), {}
+        return 'POST', reverse('posts:post_create'), {
+            'text': 'Пост нагрузочного теста',
+            'group': rng.choice(self.groups)[0],
+        }
+
+    def worker(self, number, application, weights, options, budget):
+        rng = random.Random(options['seed'] + number)
+        names, shares = list(weights), list(weights.values())
+        results = []
+        anonymous = Identity()
+        deadline = options['duration'] and time.monotonic() + options[
+            'duration'
+        ]
+        try:
+            while (
+                time.monotonic() < deadline if deadline
+                else next(budget) < options['requests']
+            ):
+                name = rng.choices(names, shares)[0]
+                logged_in = (
+                    SCENARIOS[name][1] or rng.random() < options['logged_in']
+                )
+                identity = rng.choice(self.members) if logged_in else anonymous
+                environ = identity.environ(*self.request_for(name, rng))
+                statuses = []
+                start = time.perf_counter()
+                body = application(
+                    environ, lambda status, headers: statuses.append(status)
+                )
+                for _ in body:
+                    pass
+                body.close()
+                took = time.perf_counter() - start
+                results.append((name, int(statuses[0].split()[0]), took))
+        finally:
+            connection.close()
+        return results
+
+    def handle(self, *args, **options):
+        from yatube.wsgi import application
+
+        weights = self.weights(options)
+        self.load_samples(options)
+        errors = ErrorLog()
+        got_request_exception.connect(errors)
+        budget = count()
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(options['threads']) as pool:
+                futures = [
+                    pool.submit(
+                        self.worker, number, application, weights, options,
+                        budget,
+                    )
+                    for number in range(options['threads'])
+                ]
+                results = [
+                    row for future in futures for row in future.result()
+                ]
+        finally:
+            got_request_exception.disconnect(errors)
+        elapsed = time.perf_counter() - start
+        self.report(results, errors.errors, elapsed, options)
+
+    def report(self, results, errors, elapsed, options):
+        durations = defaultdict(list)
+        statuses = Counter()
+        for name, status, took in results:
+            durations[name].append(took)
+            statuses[status] += 1
+        every = [took for _, _, took in results]
+        report = {
+            'threads': options['threads'],
+            'requests': len(results),
+            'seconds': round(elapsed, 3),
+            'throughput': round(len(results) / elapsed, 1) if elapsed else 0,
+            'statuses': {str(status): n for status, n in statuses.items()},
+            'errors': dict(errors),
+            'latency': summarize(every),
+            'scenarios': {
+                name: summarize(values) for name, values in durations.items()
+            },
+            'histogram': {
+                str(bound or 'inf'): n
+                for bound, n in histogram(every).items()
+            },
+        }
+        self.stdout.write(
+            f'{report["requests"]} requests in {report["seconds"]} s, '
+            f'{report["throughput"]} req/s with {options["threads"]} threads'
+        )
+        self.stdout.write(f'{"scenario":<14}{"count":>7}{"p50":>9}'
+                          f'{"p95":>9}{"p99":>9}')
+        for name, summary in sorted(report['scenarios'].items()):
+            self.stdout.write(
+                f'{name:<14}{summary["count"]:>7}{summary["p50_ms"]:>9.2f}'
+                f'{summary["p95_ms"]:>9.2f}{summary["p99_ms"]:>9.2f}'
+            )
+        widest = max(report['histogram'].values()) or 1
+        for bound, n in report['histogram'].items():
+            label = (
+                f'<= {bound} ms' if bound != 'inf'
+                else f'> {HISTOGRAM_BOUNDS_MS[-1]} ms'
+            )
+            bar = '#' * round(40 * n / widest)
+            self.stdout.write(f'{label:>12} {n:>7} {bar}')
+        self.stdout.write('statuses: ' + ', '.join(
+            f'{status}: {n}' for status, n in sorted(statuses.items())
+        ))
+        for message, n in errors.most_common():
+            self.stdout.write(self.style.ERROR(f'{n:>7} x {message}'))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, ensure_ascii=False)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import render_thumbnails, worker_pool
+
+
+class Command(BaseCommand):
+    help = 'Renders feed thumbnails of existing post images in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            help='Worker processes, THUMBNAIL_WORKERS by default.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=20,
+            help='Images handed to a worker at once.',
+        )
+
+    def handle(self, *args, **options):
+        names = Post.objects.exclude(image='').order_by('image').values_list(
+            'image', flat=True
+        ).distinct()
+        done = failed = 0
+        with worker_pool(options['workers']) as pool:
+            results = pool.map(
+                render_thumbnails,
+                names.iterator(),
+                chunksize=options['chunk_size'],
+            )
+            for error in results:
+                done += 1
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(error)
+                if done % 100 == 0:
+                    self.stdout.write(f'{done} images done')
+        self.stdout.write(self.style.SUCCESS(
+            f'Done, {done} images, {failed} failed.'
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from posts.models import Post
+from posts.search import FTS_TABLE, fts_available, restore_triggers
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the full-text search index of posts in chunks, '
+        'in one transaction, and recreates missing sync triggers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Number of post ids reindexed per statement.',
+        )
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError('Full-text index needs the sqlite backend.')
+        chunk_size = options['chunk_size']
+        # One transaction: searches keep reading the old index until the
+        # commit, and posts written meanwhile wait instead of racing the
+        # refill for their rowid.
+        with transaction.atomic(), connection.cursor() as cursor:
+            restore_triggers()
+            last_id = Post.objects.aggregate(last=Max('pk'))['last'] or 0
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')"
+            )
+            for start in range(0, last_id, chunk_size):
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE}(rowid, text) '
+                    'SELECT id, text FROM posts_post '
+                    'WHERE id > %s AND id <= %s',
+                    (start, start + chunk_size)
+                )
+                self.stdout.write(
+                    f'{min(start + chunk_size, last_id)} of {last_id} '
+                    'post ids indexed'
+                )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"
+            )
+        self.stdout.write(self.style.SUCCESS('Done.'))
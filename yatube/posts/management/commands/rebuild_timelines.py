@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import timeline
+from posts.models import Follow, Timeline
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds materialized follow timelines in batches of users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of followers rebuilt per transaction.',
+        )
+        parser.add_argument(
+            '--user', action='append', dest='usernames', default=[],
+            help='Rebuild only this user, may be given several times.',
+        )
+
+    def handle(self, *args, **options):
+        followers = Follow.objects.order_by('user_id').values_list(
+            'user_id', flat=True
+        ).distinct()
+        if options['usernames']:
+            followers = followers.filter(
+                user__username__in=options['usernames']
+            )
+        else:
+            Timeline.objects.exclude(
+                user_id__in=Follow.objects.values('user_id')
+            ).delete()
+        user_ids = list(followers)
+        celebrities = list(timeline.all_celebrity_ids())
+        batch_size = options['batch_size']
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            with transaction.atomic():
+                timeline.rebuild(batch, celebrities)
+            self.stdout.write(
+                f'{start + len(batch)}/{len(user_ids)} timelines rebuilt'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Done, {len(celebrities)} authors are merged at read time.'
+        ))
@@ -0,0 +1,38 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import images, stats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes denormalized post and follow counters of users and '
+        'reference counters of stored images.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of users recounted per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = User.objects.order_by('pk').values_list('pk', flat=True)
+        batch_size = options['batch_size']
+        last_pk = 0
+        total = 0
+        while True:
+            batch = list(user_ids.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                stats.recount(batch)
+            last_pk = batch[-1]
+            total += len(batch)
+            self.stdout.write(f'{total} users recounted')
+        images.recount()
+        self.stdout.write('Image references recounted')
+        self.stdout.write(self.style.SUCCESS('Done.'))
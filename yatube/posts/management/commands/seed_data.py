@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.seeding import Seeder
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-inserts fake users, groups, posts, comments and follows with '
+        'power-law skewed authorship and follower counts.'
+    )
+
+    def add_arguments(self, parser):
+        for name, default in (
+            ('users', 10000), ('groups', 100), ('posts', 1000000),
+            ('comments', 1000000), ('follows', 500000),
+        ):
+            parser.add_argument(
+                f'--{name}', type=int, default=default,
+                help=f'Number of {name} to add, {default} by default.',
+            )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Rows per INSERT, SQLite allows at most 500.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=20000,
+            help='Rows per transaction.',
+        )
+        parser.add_argument(
+            '--skew', type=float, default=2.0,
+            help='Power-law exponent of activity, 1 spreads it evenly.',
+        )
+        parser.add_argument(
+            '--password',
+            help='Password of every new user, hashed once. Unusable if unset.',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Spread publication dates over this many past days.',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--no-timelines', action='store_false', dest='timelines',
+            help='Do not rebuild follow timelines afterwards.',
+        )
+
+    def handle(self, *args, **options):
+        if options['skew'] < 1:
+            raise CommandError('--skew must be 1 or more.')
+        start = time.perf_counter()
+        Seeder(
+            random_seed=options['seed'],
+            batch_size=options['batch_size'],
+            chunk_size=options['chunk_size'],
+            skew=options['skew'],
+            password=options['password'],
+            days=options['days'],
+            stdout=self.stdout,
+        ).seed(
+            options['users'], options['groups'], options['posts'],
+            options['comments'], options['follows'], options['timelines'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Done in {time.perf_counter() - start:.1f} s.'
+        ))
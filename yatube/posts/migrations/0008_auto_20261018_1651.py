@@ -0,0 +1,53 @@
+# Generated by Django 2.2.16 on 2026-10-18 16:51
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_timelines(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    Timeline = apps.get_model('posts', 'Timeline')
+    celebrities = Follow.objects.values('author').annotate(
+        followers=models.Count('id')
+    ).filter(
+        followers__gt=settings.TIMELINE_FANOUT_LIMIT
+    ).values('author')
+    pairs = Follow.objects.filter(author__posts__isnull=False).exclude(
+        author__in=celebrities
+    ).values_list('user_id', 'author__posts')
+    entries = (
+        Timeline(user_id=user_id, post_id=post_id)
+        for user_id, post_id in pairs.iterator()
+    )
+    while True:
+        batch = list(islice(entries, settings.TIMELINE_BATCH_SIZE))
+        if not batch:
+            return
+        Timeline.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0007_auto_20230319_0101'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Timeline',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='posts.Post', verbose_name='пост')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='читатель')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='timeline',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
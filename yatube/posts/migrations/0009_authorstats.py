@@ -0,0 +1,59 @@
+# Generated by Django 2.2.16 on 2026-10-18 16:53
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def grouped(queryset, field):
+    return dict(
+        queryset.order_by().values_list(field).annotate(
+            total=models.Count('id')
+        )
+    )
+
+
+def count_stats(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Post = apps.get_model('posts', 'Post')
+    Follow = apps.get_model('posts', 'Follow')
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    posts = grouped(Post.objects, 'author_id')
+    followers = grouped(Follow.objects, 'author_id')
+    following = grouped(Follow.objects, 'user_id')
+    stats = (
+        AuthorStats(
+            user_id=pk,
+            posts_count=posts.get(pk, 0),
+            followers_count=followers.get(pk, 0),
+            following_count=following.get(pk, 0),
+        ) for pk in User.objects.values_list('pk', flat=True).iterator()
+    )
+    while True:
+        batch = list(islice(stats, 1000))
+        if not batch:
+            return
+        AuthorStats.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0008_auto_20261018_1651'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='пользователь')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='постов')),
+                ('followers_count', models.PositiveIntegerField(default=0, verbose_name='подписчиков')),
+                ('following_count', models.PositiveIntegerField(default=0, verbose_name='подписок')),
+            ],
+        ),
+        migrations.RunPython(count_stats, migrations.RunPython.noop),
+    ]
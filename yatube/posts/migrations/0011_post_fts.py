@@ -0,0 +1,61 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:05
+
+from django.db import migrations
+
+# Bodies of the triggers that keep the index in sync, by trigger name.
+TRIGGERS = {
+    'posts_post_fts_insert': (
+        "AFTER INSERT ON posts_post BEGIN "
+        "INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); "
+        "END"
+    ),
+    'posts_post_fts_delete': (
+        "AFTER DELETE ON posts_post BEGIN "
+        "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        "END"
+    ),
+    'posts_post_fts_update': (
+        "AFTER UPDATE OF text ON posts_post BEGIN "
+        "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        "INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); "
+        "END"
+    ),
+}
+
+FTS_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts USING fts5("
+    "text, content='posts_post', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    *(
+        f"CREATE TRIGGER IF NOT EXISTS {name} {body}"
+        for name, body in TRIGGERS.items()
+    ),
+    "INSERT INTO posts_post_fts(posts_post_fts) VALUES ('rebuild')",
+)
+
+DROP_SQL = (
+    *(f"DROP TRIGGER IF EXISTS {name}" for name in TRIGGERS),
+    "DROP TABLE IF EXISTS posts_post_fts",
+)
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_auto_20261018_1701'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(FTS_SQL), run_sqlite(DROP_SQL)),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:44
+
+from django.db import migrations, models
+import posts.storage
+
+# Altering a column remakes posts_post on SQLite and drops its triggers.
+TRIGGERS_SQL = (
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert "
+    "AFTER INSERT ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete "
+    "AFTER DELETE ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_update "
+    "AFTER UPDATE OF text ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); "
+    "END",
+)
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+def count_images(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    StoredImage = apps.get_model('posts', 'StoredImage')
+    images = Post.objects.exclude(image='').order_by().values_list(
+        'image'
+    ).annotate(total=models.Count('pk'))
+    StoredImage.objects.bulk_create(
+        [StoredImage(name=name, refs=total) for name, total in images],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_post_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            migrations.RunPython.noop, run_sqlite(TRIGGERS_SQL)
+        ),
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='файл')),
+                ('refs', models.PositiveIntegerField(default=0, verbose_name='ссылок')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, help_text='картинка', storage=posts.storage.ContentAddressedStorage(), upload_to='posts/'),
+        ),
+        migrations.RunPython(
+            run_sqlite(TRIGGERS_SQL), migrations.RunPython.noop
+        ),
+        migrations.RunPython(count_images, migrations.RunPython.noop),
+    ]
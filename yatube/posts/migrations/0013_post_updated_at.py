@@ -0,0 +1,62 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+# Adding a column remakes posts_post on SQLite and drops its triggers.
+TRIGGERS_SQL = (
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert "
+    "AFTER INSERT ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete "
+    "AFTER DELETE ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_update "
+    "AFTER UPDATE OF text ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); "
+    "END",
+)
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+def copy_pub_date(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(updated_at=models.F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_stored_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            migrations.RunPython.noop,
+            run_sqlite(TRIGGERS_SQL),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, help_text='Меняется при каждом сохранении, версия поста.', verbose_name='Дата изменения.'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(
+            run_sqlite(TRIGGERS_SQL),
+            migrations.RunPython.noop,
+        ),
+        migrations.RunPython(copy_pub_date, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def copy_pub_date(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Timeline = apps.get_model('posts', 'Timeline')
+    Timeline.objects.update(pub_date=models.Subquery(
+        Post.objects.filter(pk=models.OuterRef('post_id')).values(
+            'pub_date'
+        )[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timeline',
+            name='pub_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Копия даты поста, по ней лента читается по индексу.', verbose_name='дата публикации'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_pub_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='timeline',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='timeline_user_date_idx'),
+        ),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 
+from posts.storage import ContentAddressedStorage
+
 
 class Group(models.Model):
     '''Model for group creating'''
@@ -37,6 +39,11 @@ class Post(models.Model):
         verbose_name='Дата публикации.',
         help_text='Дата устанавливается автоматически.'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения.',
+        help_text='Меняется при каждом сохранении, версия поста.'
+    )
     author = models.ForeignKey(
         User, on_delete=models.CASCADE,
         related_name='posts',
@@ -53,17 +60,32 @@ class Post(models.Model):
     image = models.ImageField(
         help_text='картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
 
     class Meta:
         '''Used for ordering posts by newest.'''
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(fields=('pub_date',), name='post_pub_date_idx'),
+            models.Index(
+                fields=('author', 'pub_date'), name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=('group', 'pub_date'), name='post_group_pub_date_idx'
+            ),
+        )
 
     def __str__(self):
         '''Shows first 15 characters of text.'''
         return self.text[:15]
 
+    def save(self, *args, **kwargs):
+        '''Saves together with the counters moved by post_save.'''
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -87,6 +109,13 @@ class Comment(models.Model):
         auto_now_add=True
     )
 
+    class Meta:
+        indexes = (
+            models.Index(
+                fields=('post', 'created'), name='comment_post_created_idx'
+            ),
+        )
+
     def __str__(self) -> str:
         return self.text[:15]
 
@@ -114,6 +143,95 @@ class Follow(models.Model):
                 name='уникальная связка'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('author', 'user'), name='follow_author_user_idx'
+            ),
+        )
 
         def __str__(self):
             return (f'{self.user} подписан на {self.author}')
+
+    def save(self, *args, **kwargs):
+        '''Saves together with the counters moved by post_save.'''
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class AuthorStats(models.Model):
+    '''Denormalized post and follow counters of a user.'''
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='пользователь',
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='постов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='подписчиков',
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='подписок',
+    )
+
+    def __str__(self):
+        return f'{self.user_id}: {self.posts_count} постов'
+
+
+class Timeline(models.Model):
+    '''Materialized follow feed: one row per follower per post.'''
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='читатель',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='пост',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='дата публикации',
+        help_text='Копия даты поста, по ней лента читается по индексу.'
+    )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'post'),
+                name='unique_timeline_entry'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-post'),
+                name='timeline_user_date_idx',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user_id}: {self.post_id}'
+
+
+class StoredImage(models.Model):
+    '''Number of posts that refer to a stored image file.'''
+    name = models.CharField(
+        max_length=100,
+        primary_key=True,
+        verbose_name='файл',
+    )
+    refs = models.PositiveIntegerField(
+        default=0,
+        verbose_name='ссылок',
+    )
+
+    def __str__(self):
+        return f'{self.name}: {self.refs}'
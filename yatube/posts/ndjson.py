@@ -0,0 +1,86 @@
+import json
+import zlib
+
+from django.db import transaction
+
+from posts.bulk import batched, insert_keeping_dates
+from posts.models import Comment, Follow, Post
+
+MODELS = {'post': Post, 'comment': Comment, 'follow': Follow}
+
+
+def columns(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def dump(querysets, chunk_size=2000):
+    '''Yields one NDJSON line per row, reading rows chunk by chunk.
+
+    `querysets` maps model names of MODELS to querysets of that model.
+    '''
+    encoder = json.JSONEncoder(
+        ensure_ascii=False, default=lambda value: value.isoformat()
+    )
+    for name, queryset in querysets.items():
+        fields = columns(queryset.model)
+        rows = queryset.order_by('pk').values_list(*fields)
+        for row in rows.iterator(chunk_size=chunk_size):
+            record = {'model': name, **dict(zip(fields, row))}
+            yield (encoder.encode(record) + '\n').encode()
+
+
+def gzipped(chunks, level=6):
+    '''Compresses a stream of byte chunks into one gzip stream.'''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def parse(line):
+    '''One NDJSON record, ValueError for anything but a JSON object.'''
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError(f'Expected a JSON object, got {line!r}')
+    return record
+
+
+def load(lines, batch_size=500):
+    '''Inserts rows from NDJSON lines, one transaction per batch.
+
+    Rows keep their primary keys and rows that already exist are
+    skipped. Returns the number of rows read per model name.
+    '''
+    counts = dict.fromkeys(MODELS, 0)
+    records = (parse(line) for line in lines if line.strip())
+    for batch in batched(records, batch_size):
+        objects = {}
+        for record in batch:
+            name = record.pop('model', None)
+            if name not in MODELS:
+                raise ValueError(f'Unknown model: {name}')
+            objects.setdefault(name, []).append(MODELS[name](**record))
+        with transaction.atomic():
+            for name, items in objects.items():
+                model = MODELS[name]
+                existing = set(model.objects.filter(
+                    pk__in=[item.pk for item in items]
+                ).values_list('pk', flat=True))
+                insert_keeping_dates(
+                    model, [item for item in items if item.pk not in existing],
+                    ignore_conflicts=True,
+                )
+                counts[name] += len(items)
+    return counts
+
+
+def author_querysets(author, names=tuple(MODELS)):
+    '''Posts of an author, the comments under them and whom they follow.'''
+    querysets = {
+        'post': Post.objects.filter(author=author),
+        'comment': Comment.objects.filter(post__author=author),
+        'follow': Follow.objects.filter(user=author),
+    }
+    return {name: querysets[name] for name in names}
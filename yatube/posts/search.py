@@ -0,0 +1,135 @@
+import re
+from contextlib import contextmanager
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from posts.models import Post
+
+FTS_TABLE = 'posts_post_fts'
+WORD = re.compile(r'\w+')
+# Bodies of the triggers that keep the index in sync, by trigger name.
+# Migrations keep frozen copies of the SQL they ran.
+SYNC_TRIGGERS = {
+    'posts_post_fts_insert': (
+        "AFTER INSERT ON posts_post BEGIN "
+        "INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); "
+        "END"
+    ),
+    'posts_post_fts_delete': (
+        "AFTER DELETE ON posts_post BEGIN "
+        "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        "END"
+    ),
+    'posts_post_fts_update': (
+        "AFTER UPDATE OF text ON posts_post BEGIN "
+        "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        "INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); "
+        "END"
+    ),
+}
+
+
+def match_expression(query):
+    '''Turns user input into an FTS5 query: all words, the last as prefix.'''
+    words = WORD.findall(query)
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def restore_triggers():
+    '''Recreates the index sync triggers that are missing.'''
+    with connection.cursor() as cursor:
+        for name, body in SYNC_TRIGGERS.items():
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+
+
+@contextmanager
+def deferred_indexing():
+    '''Drops the index sync triggers for a bulk load, reindexes after it.
+
+    Rebuilding the index once is several times faster than updating it
+    from a trigger for every inserted row. If the process dies inside,
+    the triggers stay dropped: run rebuild_search_index, which recreates
+    them along with the index.
+    '''
+    if not fts_available():
+        yield
+        return
+    with connection.cursor() as cursor:
+        for name in SYNC_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    try:
+        yield
+    finally:
+        restore_triggers()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+            )
+
+
+def matching_ids(query):
+    '''Subquery of ids of posts matching the query, for pk__in filters.'''
+    return RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (match_expression(query),)
+    )
+
+
+def filter_posts(queryset, query):
+    '''Narrows a Post queryset down to the posts matching the query.'''
+    if not match_expression(query):
+        return queryset.none()
+    if not fts_available():
+        return queryset.filter(text__icontains=query)
+    return queryset.filter(pk__in=matching_ids(query))
+
+
+class SearchResults:
+    '''Lazy BM25-ranked results that Paginator can count and slice.'''
+
+    def __init__(self, query):
+        self.query = query
+        self.expression = match_expression(query)
+
+    def count(self):
+        if not self.expression:
+            return 0
+        if not fts_available():
+            return filter_posts(Post.objects, self.query).count()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT count(*) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s',
+                (self.expression,)
+            )
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, page):
+        if not self.expression:
+            return []
+        posts = Post.objects.select_related('author', 'group')
+        if not fts_available():
+            return list(filter_posts(posts, self.query)[page])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                'ORDER BY rank LIMIT %s OFFSET %s',
+                (self.expression, page.stop - page.start, page.start)
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        found = posts.in_bulk(ids)
+        return [found[pk] for pk in ids if pk in found]
@@ -0,0 +1,216 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from faker import Faker
+
+from posts.bulk import batched, sync_denormalized
+from posts.models import Comment, Follow, Group, Post
+from posts.search import deferred_indexing
+
+User = get_user_model()
+
+
+def bulk_insert(model, objects, batch_size=500, chunk_size=20000):
+    '''Inserts objects with bulk_create, one transaction per chunk.
+
+    Returns the (first, last) primary keys of the new rows.
+    '''
+    first = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    for chunk in batched(objects, chunk_size):
+        with transaction.atomic():
+            model.objects.bulk_create(
+                chunk, batch_size=batch_size, ignore_conflicts=True
+            )
+    added = model.objects.filter(pk__gt=first).aggregate(
+        first=Min('pk'), last=Max('pk')
+    )
+    return added['first'], added['last']
+
+
+@contextmanager
+def unsynchronized():
+    '''Skips fsync on every commit of a SQLite database while seeding.
+
+    Inside a transaction the level cannot change and nothing is done.
+    '''
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA synchronous')
+        synchronous = cursor.fetchone()[0]
+        cursor.execute('PRAGMA synchronous = OFF')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA synchronous = {int(synchronous)}')
+
+
+class Seeder:
+    '''Fills the database with fake users, groups, posts and follows.
+
+    Rows are only referenced by primary key ranges, so memory use does
+    not grow with the size of the dataset. With `skew` above 1 users with
+    lower ids write more posts and gain more followers, following a
+    power law; 1 picks everyone equally often.
+    '''
+
+    def __init__(self, random_seed=0, batch_size=500, chunk_size=20000,
+                 skew=1.0, password=None, days=365, stdout=None):
+        self.random = random.Random(random_seed)
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.skew = skew
+        self.password = make_password(password)
+        self.days = days
+        self.now = timezone.now()
+        self.stdout = StringIO() if stdout is None else stdout
+        fake = Faker('ru_RU')
+        fake.seed_instance(random_seed)
+        self.texts = [fake.paragraph() for _ in range(500)]
+        self.prefix = f'seed{User.objects.count()}_'
+
+    def insert(self, model, objects):
+        start = time.perf_counter()
+        first, last = bulk_insert(
+            model, objects, self.batch_size, self.chunk_size
+        )
+        took = time.perf_counter() - start
+        added = 0 if first is None else last - first + 1
+        self.stdout.write(
+            f'{model.__name__}: {added} rows inserted in {took:.1f} s'
+            f' ({added / took if took else 0:.0f} rows/s)'
+        )
+        return first, last
+
+    def text(self):
+        return self.random.choice(self.texts)
+
+    def pick(self, ids):
+        '''Random id of a (first, last) range, skewed to the first ones.'''
+        first, last = ids
+        return first + int(
+            (last - first + 1) * self.random.random() ** self.skew
+        )
+
+    def date(self):
+        return self.now - timedelta(
+            seconds=self.random.random() * self.days * 24 * 60 * 60
+        )
+
+    def users(self, count):
+        return self.insert(User, (
+            User(username=f'{self.prefix}{i}', password=self.password)
+            for i in range(count)
+        ))
+
+    def groups(self, count):
+        return self.insert(Group, (
+            Group(
+                title=f'Группа {self.prefix}{i}',
+                slug=f'{self.prefix}{i}',
+                description=self.text(),
+            )
+            for i in range(count)
+        ))
+
+    def posts(self, count, users, groups):
+        return self.insert(Post, (
+            Post(
+                text=self.text(),
+                author_id=self.pick(users),
+                group_id=(
+                    self.pick(groups)
+                    if groups[0] and self.random.random() < 0.7 else None
+                ),
+            )
+            for _ in range(count)
+        ))
+
+    def spread_dates(self, model, field, ids):
+        '''Moves the auto_now_add dates of new rows over the last `days`.
+
+        bulk_create stamps every row with the current time, the random
+        dates are set afterwards.
+        '''
+        field = model._meta.get_field(field)
+        quote = connection.ops.quote_name
+        sql = (
+            f'UPDATE {quote(model._meta.db_table)} '
+            f'SET {quote(field.column)} = %s '
+            f'WHERE {quote(model._meta.pk.column)} = %s'
+        )
+        first, last = ids
+        for start in range(first, last + 1, self.chunk_size):
+            rows = [
+                (field.get_db_prep_value(self.date(), connection), pk)
+                for pk in range(start, min(start + self.chunk_size, last + 1))
+            ]
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+
+    def comments(self, count, users, posts):
+        return self.insert(Comment, (
+            Comment(
+                text=self.text(),
+                author_id=self.random.randint(*users),
+                post_id=self.pick(posts),
+            )
+            for _ in range(count)
+        ))
+
+    def authors_for(self, user_id, amount, users):
+        '''Distinct authors for a follower, popular ones more likely.'''
+        chosen = set()
+        for _ in range(amount * 4):
+            if len(chosen) == amount:
+                return chosen
+            author_id = self.pick(users)
+            if author_id != user_id:
+                chosen.add(author_id)
+        first, last = users
+        rest = [
+            author_id for author_id in range(first, last + 1)
+            if author_id != user_id and author_id not in chosen
+        ]
+        return chosen | set(self.random.sample(rest, amount - len(chosen)))
+
+    def follows(self, count, users):
+        first, last = users
+        total = last - first + 1
+        per_user, extra = divmod(count, total)
+
+        def pairs():
+            for user_id in range(first, last + 1):
+                amount = min(per_user + (user_id - first < extra), total - 1)
+                for author_id in self.authors_for(user_id, amount, users):
+                    yield Follow(user_id=user_id, author_id=author_id)
+
+        return self.insert(Follow, pairs())
+
+    def seed(self, users=1000, groups=20, posts=20000, comments=20000,
+             follows=20000, timelines=True):
+        with unsynchronized(), deferred_indexing():
+            user_ids = self.users(users)
+            if None in user_ids:
+                return
+            group_ids = self.groups(groups)
+            post_ids = self.posts(posts, user_ids, group_ids)
+            if None not in post_ids:
+                self.spread_dates(Post, 'pub_date', post_ids)
+            if comments and None not in post_ids:
+                comment_ids = self.comments(comments, user_ids, post_ids)
+                if None not in comment_ids:
+                    self.spread_dates(Comment, 'created', comment_ids)
+            if follows and users > 1:
+                self.follows(follows, user_ids)
+        sync_denormalized(self.stdout, timelines)
@@ -0,0 +1,120 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_save
+)
+from django.dispatch import receiver
+
+from posts import images, stats, timeline
+from posts.models import AuthorStats, Comment, Follow, Group, Post
+from posts.utils import adjust_count, bump_feed_version, count_key
+
+
+def post_count_keys(author_id, group_id):
+    keys = [count_key('index'), count_key('author', author_id)]
+    if group_id is not None:
+        keys.append(count_key('group', group_id))
+    return keys
+
+
+@receiver(post_init, sender=Post)
+def remember_loaded_values(sender, instance, **kwargs):
+    '''Group and image as loaded, so an edit needs no query for them.'''
+    values = instance.__dict__
+    if 'group_id' in values and 'image' in values:
+        image = values['image']
+        instance._loaded = (
+            values['group_id'], getattr(image, 'name', image) or ''
+        )
+
+
+@receiver(pre_save, sender=Post)
+def remember_stored_values(sender, instance, **kwargs):
+    '''Keeps the stored group and image an edit may replace.'''
+    stored = (None, '')
+    if instance.pk is not None:
+        if not instance._state.adding and hasattr(instance, '_loaded'):
+            stored = instance._loaded
+        else:
+            stored = Post.objects.filter(pk=instance.pk).values_list(
+                'group_id', 'image'
+            ).first() or stored
+    instance._stored_group_id, instance._stored_image = stored
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    if created:
+        for key in post_count_keys(instance.author_id, instance.group_id):
+            adjust_count(key, 1)
+        stats.adjust(instance.author_id, 'posts_count', 1)
+        timeline.fan_out(instance)
+        return
+    stored_group_id = getattr(instance, '_stored_group_id', None)
+    if stored_group_id != instance.group_id:
+        if stored_group_id is not None:
+            adjust_count(count_key('group', stored_group_id), -1)
+        if instance.group_id is not None:
+            adjust_count(count_key('group', instance.group_id), 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    for key in post_count_keys(instance.author_id, instance.group_id):
+        adjust_count(key, -1)
+    stats.adjust(instance.author_id, 'posts_count', -1)
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs(sender, instance, created, **kwargs):
+    stored_image = getattr(instance, '_stored_image', '')
+    if instance.image.name != stored_image:
+        images.retain(instance.image.name)
+        images.release(stored_image)
+
+
+@receiver(post_delete, sender=Post)
+def release_image(sender, instance, **kwargs):
+    images.release(instance.image.name)
+
+
+@receiver(post_save, sender=get_user_model())
+def create_stats(sender, instance, created, raw=False, **kwargs):
+    '''Zero counters for new users, so their first write needs no recount.'''
+    if created and not raw:
+        AuthorStats.objects.create(user_id=instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        stats.adjust(instance.author_id, 'followers_count', 1)
+        stats.adjust(instance.user_id, 'following_count', 1)
+        timeline.backfill(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def count_unfollow(sender, instance, **kwargs):
+    stats.adjust(instance.author_id, 'followers_count', -1)
+    stats.adjust(instance.user_id, 'following_count', -1)
+    timeline.prune(instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def expire_feeds(sender, **kwargs):
+    bump_feed_version()
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def expire_comment_pages(sender, created=False, **kwargs):
+    '''Edits and deletes keep the newest comment the post ETag reads.'''
+    if not created:
+        bump_feed_version()
+
+
+@receiver(post_save, sender=Post)
+def remember_saved_values(sender, instance, **kwargs):
+    instance._loaded = (instance.group_id, instance.image.name or '')
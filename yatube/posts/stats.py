@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models import Count, F
+
+from posts.models import AuthorStats, Follow, Post
+
+
+def _counts(queryset, field, user_ids):
+    return dict(
+        queryset.filter(**{f'{field}__in': user_ids}).order_by().values_list(
+            field
+        ).annotate(total=Count('id'))
+    )
+
+
+def recount(user_ids):
+    '''Recomputes the counters of the given users from Post and Follow.'''
+    posts = _counts(Post.objects, 'author_id', user_ids)
+    followers = _counts(Follow.objects, 'author_id', user_ids)
+    following = _counts(Follow.objects, 'user_id', user_ids)
+    existing = set(AuthorStats.objects.filter(
+        user_id__in=user_ids
+    ).values_list('user_id', flat=True))
+    stats = [
+        AuthorStats(
+            user_id=user_id,
+            posts_count=posts.get(user_id, 0),
+            followers_count=followers.get(user_id, 0),
+            following_count=following.get(user_id, 0),
+        )
+        for user_id in user_ids
+    ]
+    AuthorStats.objects.bulk_update(
+        [item for item in stats if item.user_id in existing],
+        ('posts_count', 'followers_count', 'following_count'),
+    )
+    AuthorStats.objects.bulk_create(
+        [item for item in stats if item.user_id not in existing],
+        ignore_conflicts=True,
+    )
+
+
+def adjust(user_id, counter, delta):
+    '''Moves one counter of a user inside the current transaction.
+
+    Post and Follow save and delete in a transaction, so the counter
+    commits or rolls back with the row. A missing row is created by a
+    full recount on increments only, so cascading deletes of the user
+    never recreate it.
+    '''
+    with transaction.atomic(savepoint=False):
+        stats = AuthorStats.objects.filter(user_id=user_id)
+        if delta < 0:
+            stats = stats.filter(**{f'{counter}__gte': -delta})
+        updated = stats.update(**{counter: F(counter) + delta})
+        if not updated and delta > 0:
+            recount([user_id])
+
+
+def stats_for(user):
+    '''Counters of a user, zeros if nothing was counted yet.'''
+    return AuthorStats.objects.filter(user=user).first() or AuthorStats(
+        user=user
+    )
@@ -0,0 +1,50 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    '''Stores every file under the sha256 of its content.
+
+    Uploading a file that is already stored writes nothing and returns
+    the existing name, so identical images share one file and one set of
+    thumbnails. That holds for concurrent uploads too: the file is
+    created exclusively and losing the race means the content is there.
+    Files are removed by posts.images.release once no post refers to
+    them.
+    '''
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(
+            os.path.dirname(name), digest[:2], digest + extension
+        )
+
+    def get_available_name(self, name, max_length=None):
+        '''The hashed name itself, never a suffixed copy of it.
+
+        FileSystemStorage._save asks for another name when the file
+        appeared after the check, the error then ends the save instead.
+        '''
+        if self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        try:
+            return super().save(name, content, max_length)
+        except FileExistsError:
+            return name
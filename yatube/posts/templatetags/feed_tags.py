@@ -0,0 +1,104 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from core.cache import get_or_refresh
+from posts.utils import card_cache_key, feed_cache_key
+
+register = template.Library()
+
+CARD_TEMPLATES = {
+    'feed': 'posts/includes/cards/feed.html',
+    'group': 'posts/includes/cards/group.html',
+    'profile': 'posts/includes/cards/profile.html',
+}
+
+
+@register.filter
+def next_cursor(page):
+    '''Cursor of the last post on a page, used for keyset "next" links.'''
+    if not page.has_next() or not hasattr(page.paginator, 'cursor_for'):
+        return ''
+    return page.paginator.cursor_for(page[len(page) - 1])
+
+
+@register.filter
+def page_window(page, on_each_side=2):
+    '''Page numbers around the current page plus the first and last ones.
+
+    None marks a gap in the sequence.
+    '''
+    last = page.paginator.num_pages
+    start = max(page.number - on_each_side, 1)
+    end = min(page.number + on_each_side, last)
+    numbers = list(range(start, end + 1))
+    if start > 1:
+        numbers = [1] + ([None] if start > 2 else []) + numbers
+    if end < last:
+        numbers = numbers + ([None] if end < last - 1 else []) + [last]
+    return numbers
+
+
+@register.simple_tag
+def post_cards(posts, variant):
+    '''Rendered cards of a page of posts as (post, html) pairs.
+
+    Cards are cached per post version and shared by every feed using the
+    variant: one get_many for the page, then only missing cards are
+    rendered and stored with one set_many.
+    '''
+    posts = list(posts)
+    keys = [card_cache_key(post, variant) for post in posts]
+    cards = cache.get_many(keys)
+    missing = {}
+    for post, key in zip(posts, keys):
+        if key not in cards:
+            missing[key] = cards[key] = render_to_string(
+                CARD_TEMPLATES[variant], {'post': post}
+            )
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_TIMEOUT)
+    return [(post, mark_safe(cards[key])) for post, key in zip(posts, keys)]
+
+
+class FeedCacheNode(template.Node):
+    def __init__(self, nodelist, feed, vary_on):
+        self.nodelist = nodelist
+        self.feed = feed
+        self.vary_on = vary_on
+
+    def render(self, context):
+        key = feed_cache_key(
+            self.feed.resolve(context),
+            context['request'],
+            *(var.resolve(context) for var in self.vary_on)
+        )
+        return get_or_refresh(
+            key, lambda: self.nodelist.render(context),
+            settings.FEED_CACHE_TIMEOUT, settings.FEED_CACHE_GRACE,
+        )
+
+
+@register.tag
+def feedcache(parser, token):
+    '''Caches a feed fragment until the page changes or a post is saved.
+
+    Only one request renders an expired fragment, the others get the
+    stale copy meanwhile, see core.cache.get_or_refresh.
+
+    Usage: {% feedcache 'group' group.pk %}...{% endfeedcache %}
+    '''
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} tag requires a feed name.'
+        )
+    nodelist = parser.parse(('endfeedcache',))
+    parser.delete_first_token()
+    return FeedCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        [parser.compile_filter(bit) for bit in bits[2:]],
+    )
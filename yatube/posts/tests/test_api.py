@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from core.testing import QueryBudgetMixin
+from posts.api_urls import urlpatterns
+from posts.models import Follow, Group, Post
+
+User = get_user_model()
+
+
+class TestFeedApi(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='test group',
+            slug='test-slug',
+            description='test description',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(13):
+            Post.objects.create(
+                author=cls.author, group=cls.group, text=f'post {i}'
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.auth_client = Client()
+        self.auth_client.force_login(TestFeedApi.reader)
+        self.urls = {
+            'api:index': reverse('api:index'),
+            'api:group_list': reverse(
+                'api:group_list', args=(TestFeedApi.group.slug,)
+            ),
+            'api:profile': reverse(
+                'api:profile', args=(TestFeedApi.author.username,)
+            ),
+            'api:follow_index': reverse('api:follow_index'),
+        }
+
+    def test_feeds_are_paginated_by_cursor(self):
+        for view_name, url in self.urls.items():
+            with self.subTest(view_name=view_name):
+                first = self.auth_client.get(url).json()
+                self.assertEqual(len(first['results']), settings.MAX_POSTS)
+                self.assertIsNone(first['previous'])
+                second = self.auth_client.get(
+                    url, {'after': first['next']}
+                ).json()
+                self.assertEqual(
+                    len(second['results']), 13 - settings.MAX_POSTS
+                )
+                self.assertIsNone(second['next'])
+                self.assertEqual(second['results'][0]['text'], 'post 2')
+
+    def test_sparse_fieldsets(self):
+        response = self.guest_client.get(
+            self.urls['api:index'], {'fields': 'text,author'}
+        )
+        self.assertEqual(
+            response.json()['results'][0],
+            {'text': 'post 12', 'author': 'author'},
+        )
+        response = self.guest_client.get(
+            self.urls['api:index'], {'fields': 'text,password'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_feed_is_not_modified(self):
+        url = self.urls['api:index']
+        etag = self.guest_client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        other = self.guest_client.get(url, {'fields': 'id'})['ETag']
+        self.assertNotEqual(other, etag)
+        Post.objects.create(author=TestFeedApi.author, text='new post')
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_edited_post_changes_etag(self):
+        url = self.urls['api:profile']
+        etag = self.guest_client.get(url)['ETag']
+        post = Post.objects.filter(author=TestFeedApi.author).first()
+        post.text = 'edited'
+        post.save()
+        self.assertNotEqual(self.guest_client.get(url)['ETag'], etag)
+
+    def test_follow_feed_requires_login(self):
+        response = self.guest_client.get(self.urls['api:follow_index'])
+        self.assertEqual(response.status_code, 401)
+
+    def test_every_route_has_a_budget(self):
+        for pattern in urlpatterns:
+            with self.subTest(route=pattern.name):
+                self.assertIn(f'api:{pattern.name}', settings.QUERY_BUDGETS)
+
+    def test_views_stay_within_budget(self):
+        for view_name, url in self.urls.items():
+            with self.subTest(view_name=view_name):
+                self.assertWithinQueryBudget(
+                    view_name, self.auth_client, url
+                )
@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import F, Max, Min
+from django.test import Client, TestCase
+
+from core.timing import percentile, summarize
+from posts.models import AuthorStats, Comment, Follow, Post, Timeline
+from posts.seeding import Seeder
+
+User = get_user_model()
+
+
+class TestBenchmark(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Seeder(random_seed=1).seed(
+            users=10, groups=2, posts=60, comments=30, follows=25
+        )
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = os.path.join(directory.name, 'benchmark.json')
+
+    def test_seeder_fills_denormalized_data(self):
+        self.assertEqual(User.objects.count(), 10)
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertEqual(Comment.objects.count(), 30)
+        self.assertEqual(Follow.objects.count(), 25)
+        self.assertFalse(Follow.objects.filter(
+            user_id=F('author_id')
+        ).exists())
+        self.assertTrue(Timeline.objects.exists())
+
+    def test_percentiles(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(summarize([0.001, 0.003])['p50_ms'], 1.0)
+
+    def run_benchmark(self, **options):
+        call_command(
+            'benchmark', existing=True, repeat=2, warmup=0,
+            route=['posts:index', 'posts:post_detail'],
+            output=self.output, stdout=StringIO(), **options
+        )
+        with open(self.output) as file:
+            return json.load(file)
+
+    def test_results_are_saved(self):
+        results = self.run_benchmark()
+        self.assertEqual(
+            set(results['routes']), {'posts:index', 'posts:post_detail'}
+        )
+        index = results['routes']['posts:index']
+        for field in ('p50_ms', 'p95_ms', 'p99_ms', 'queries', 'peak_kb'):
+            self.assertIn(field, index)
+        self.assertEqual(index['statuses'], [200])
+        self.assertEqual(results['meta']['rows']['Post'], 60)
+
+    def test_routes_that_write_are_skipped(self):
+        follows = list(Follow.objects.values_list('pk', flat=True))
+        call_command(
+            'benchmark', existing=True, repeat=1, warmup=0,
+            output=self.output, stdout=StringIO(),
+        )
+        with open(self.output) as file:
+            routes = json.load(file)['routes']
+        self.assertIn('posts:profile', routes)
+        self.assertNotIn('posts:profile_follow', routes)
+        self.assertNotIn('posts:profile_unfollow', routes)
+        self.assertEqual(
+            list(Follow.objects.values_list('pk', flat=True)), follows
+        )
+
+    def test_regressions_against_baseline_fail(self):
+        results = self.run_benchmark()
+        for result in results['routes'].values():
+            result['p95_ms'] = 0.0001
+            result['queries'] = 0
+        baseline = self.output + '.baseline'
+        with open(baseline, 'w') as file:
+            json.dump(results, file)
+        with self.assertRaisesMessage(CommandError, 'posts:index'):
+            self.run_benchmark(baseline=baseline)
+
+
+class TestSeedData(TestCase):
+    def test_seed_data_skews_activity(self):
+        call_command(
+            'seed_data', users=50, groups=3, posts=1000, comments=100,
+            follows=400, skew=3, password='secret', days=30,
+            stdout=StringIO(),
+        )
+        posts = sorted(
+            AuthorStats.objects.values_list('posts_count', flat=True)
+        )
+        followers = sorted(
+            AuthorStats.objects.values_list('followers_count', flat=True)
+        )
+        self.assertEqual(sum(posts), 1000)
+        self.assertEqual(sum(followers), 400)
+        self.assertGreater(posts[-1], 5 * posts[len(posts) // 2])
+        self.assertGreater(followers[-1], 3 * followers[len(followers) // 2])
+        dates = Post.objects.aggregate(
+            first=Min('pub_date'), last=Max('pub_date')
+        )
+        self.assertGreater(dates['last'] - dates['first'], timedelta(days=7))
+        user = User.objects.first()
+        self.assertTrue(
+            Client().login(username=user.username, password='secret')
+        )
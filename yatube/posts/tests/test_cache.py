@@ -0,0 +1,178 @@
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from core.cache import InstrumentedSQLiteCache, SQLiteCache, get_or_refresh
+from core.profiling import Profile, current_profile
+
+
+class TestSQLiteCache(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = os.path.join(directory.name, 'cache.sqlite3')
+        self.cache = self.create()
+
+    def create(self, backend=SQLiteCache, **options):
+        return backend(self.location, {'OPTIONS': options})
+
+    def test_set_get_and_delete(self):
+        self.cache.set('key', {'value': [1, 2]})
+        self.assertEqual(self.cache.get('key'), {'value': [1, 2]})
+        self.assertTrue(self.cache.has_key('key'))
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+
+    def test_expired_entries_are_missing(self):
+        self.cache.set('key', 1, 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertFalse(self.cache.has_key('key'))
+        self.assertTrue(self.cache.add('key', 2))
+        self.assertFalse(self.cache.add('key', 3))
+        self.assertEqual(self.cache.get('key'), 2)
+
+    def test_get_many_and_set_many(self):
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(
+            self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2}
+        )
+        self.cache.delete_many(['a', 'b'])
+        self.assertEqual(self.cache.get_many(['a', 'b']), {})
+
+    def test_incr_is_atomic(self):
+        self.cache.set('counter', 0)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+        def work(_):
+            for _ in range(50):
+                self.cache.incr('counter')
+
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(work, range(4)))
+        self.assertEqual(self.cache.get('counter'), 200)
+        self.assertEqual(self.cache.decr('counter', 10), 190)
+
+    def test_least_recently_used_entries_are_culled(self):
+        cache = self.create(MAX_ENTRIES=4, CULL_FREQUENCY=2,
+                            ACCESS_RESOLUTION=0)
+        for key in 'abcd':
+            cache.set(key, key)
+        cache.get('a')
+        cache.set('e', 'e')
+        self.assertEqual(
+            cache.get_many(list('abcde')), {'a': 'a', 'd': 'd', 'e': 'e'}
+        )
+
+    def test_file_is_shared_between_instances(self):
+        self.cache.set('key', 'value')
+        other = self.create()
+        self.assertEqual(other.get('key'), 'value')
+        other.clear()
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_lookups_are_counted(self):
+        cache = self.create(InstrumentedSQLiteCache)
+        cache.set('a', 1)
+        profile = Profile()
+        token = current_profile.set(profile)
+        try:
+            cache.get('a')
+            cache.get_many(['a', 'b', 'c'])
+        finally:
+            current_profile.reset(token)
+        self.assertEqual(profile.cache_hits, 2)
+        self.assertEqual(profile.cache_misses, 2)
+
+
+class TestGetOrRefresh(SimpleTestCase):
+    def setUp(self):
+        self.cache = LocMemCache('get-or-refresh', {})
+        self.addCleanup(self.cache.clear)
+        self.calls = 0
+
+    def compute(self, took=0):
+        def compute():
+            self.calls += 1
+            time.sleep(took)
+            return self.calls
+        return compute
+
+    def get(self, timeout=60, compute=None, **kwargs):
+        return get_or_refresh(
+            'key', compute or self.compute(), timeout, cache=self.cache,
+            **kwargs
+        )
+
+    def test_fresh_value_is_reused(self):
+        self.assertEqual(self.get(beta=0), 1)
+        self.assertEqual(self.get(beta=0), 1)
+        self.assertEqual(self.calls, 1)
+        self.assertIsNone(self.cache.get('key:lock'))
+
+    def test_stale_value_is_served_while_locked(self):
+        self.get(timeout=0, grace=60)
+        self.cache.add('key:lock', True)
+        self.assertEqual(self.get(timeout=0, grace=60), 1)
+        self.cache.delete('key:lock')
+        self.assertEqual(self.get(timeout=0, grace=60), 2)
+
+    def test_value_is_refreshed_early(self):
+        self.get(compute=self.compute(took=0.01))
+        self.assertEqual(self.get(beta=10 ** 6), 2)
+
+    def test_concurrent_misses_compute_once(self):
+        with ThreadPoolExecutor(8) as pool:
+            values = list(pool.map(
+                lambda _: self.get(compute=self.compute(took=0.05), poll=0.01),
+                range(8),
+            ))
+        self.assertEqual(values, [1] * 8)
+        self.assertEqual(self.calls, 1)
+
+    def test_lock_of_a_crashed_holder_expires(self):
+        self.cache.add('key:lock', 'crashed', 0.05)
+        self.assertEqual(self.get(poll=0.01), 1)
+        self.assertIsNone(self.cache.get('key:lock'))
+
+    def test_waiter_does_not_compute_while_locked(self):
+        self.cache.add('key:lock', 'holder')
+        with ThreadPoolExecutor(1) as pool:
+            waiter = pool.submit(self.get, lock_timeout=0.01, poll=0.01)
+            time.sleep(0.1)
+            self.assertEqual(self.calls, 0)
+            self.cache.set('key', ('stored', time.time() + 60, 0))
+            self.assertEqual(waiter.result(), 'stored')
+        self.assertEqual(self.cache.get('key:lock'), 'holder')
+
+    def test_slow_holder_keeps_the_next_lock(self):
+        def compute():
+            self.cache.delete('key:lock')
+            self.cache.add('key:lock', 'next')
+            return 'slow'
+        self.assertEqual(self.get(compute=compute), 'slow')
+        self.assertEqual(self.cache.get('key:lock'), 'next')
+
+
+class TestBenchmarkCache(SimpleTestCase):
+    def test_results_are_saved(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'cache.json')
+            call_command(
+                'benchmark_cache', ops=20, threads=2, value_size=16,
+                output=output, stdout=StringIO(),
+            )
+            with open(output) as file:
+                results = json.load(file)
+        self.assertEqual(set(results), {'locmem', 'filebased', 'sqlite'})
+        self.assertEqual(results['sqlite']['lost_increments'], 0)
+        self.assertEqual(results['locmem']['get_hit']['count'], 20)
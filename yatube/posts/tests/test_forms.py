@@ -1,20 +1,47 @@
 from http import HTTPStatus as status
+from io import BytesIO
+import hashlib
+import os
 import tempfile
+from unittest import mock
 
 from django.urls import reverse
-from django.test import TestCase, Client, override_settings
+from django.test import (
+    Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
 from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from PIL import Image
 
-from posts.models import Post, Group, Comment
+from posts.images import normalize
+from posts.models import Post, Group, Comment, StoredImage
+from posts.storage import ContentAddressedStorage
 
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b"\x47\x49\x46\x38\x39\x61\x02\x00"
+    b"\x01\x00\x80\x00\x00\x00\x00\x00"
+    b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
+    b"\x00\x00\x00\x2C\x00\x00\x00\x00"
+    b"\x02\x00\x01\x00\x00\x02\x02\x0C"
+    b"\x0A\x00\x3B"
+)
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+def stored_name(content, extension):
+    digest = hashlib.sha256(content).hexdigest()
+    return f'posts/{digest[:2]}/{digest}.{extension}'
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    THUMBNAIL_KVSTORE_FILE=os.path.join(TEMP_MEDIA_ROOT, 'thumbnails.sqlite3'),
+)
 class TestForms(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -25,14 +52,7 @@ class TestForms(TestCase):
             slug='test_slug',
             description='test description'
         )
-        cls.img = (
-            b"\x47\x49\x46\x38\x39\x61\x02\x00"
-            b"\x01\x00\x80\x00\x00\x00\x00\x00"
-            b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
-            b"\x00\x00\x00\x2C\x00\x00\x00\x00"
-            b"\x02\x00\x01\x00\x00\x02\x02\x0C"
-            b"\x0A\x00\x3B"
-        )
+        cls.img = SMALL_GIF
         cls.uploaded = SimpleUploadedFile(
             name='small.gif',
             content=TestForms.img,
@@ -66,14 +86,31 @@ class TestForms(TestCase):
         self.assertTrue(
             Post.objects.filter(text=form_data['text'], author=TestForms.user,
                                 group=TestForms.group.id,
-                                image='posts/small.gif').exists())
+                                image=stored_name(self.img, 'gif')).exists())
         self.assertEqual(Post.objects.count(), count_posts + 1)
         self.assertEqual(response.status_code, status.OK)
 
+    def test_truncated_image_is_rejected(self):
+        content = BytesIO()
+        Image.effect_noise((200, 200), 64).convert('RGB').save(
+            content, 'JPEG'
+        )
+        count_posts = Post.objects.count()
+        response = self.auth_client.post(reverse('posts:post_create'), data={
+            'text': 'truncated',
+            'image': SimpleUploadedFile(
+                'broken.jpg', content.getvalue()[:content.tell() // 2]
+            ),
+        })
+        self.assertEqual(response.status_code, status.OK)
+        self.assertTrue(response.context['form'].has_error('image'))
+        self.assertEqual(Post.objects.count(), count_posts)
+
     def test_post_editing(self):
+        new_img = TestForms.img.replace(b'\xFF\xFF\xFF', b'\x00\xFF\x00')
         new_image = SimpleUploadedFile(
             name='new_small.gif',
-            content=TestForms.img,
+            content=new_img,
             content_type='image/gif'
         )
         post = Post.objects.create(
@@ -101,7 +138,190 @@ class TestForms(TestCase):
         self.assertTrue(
             Post.objects.filter(text=form_data['text'], author=TestForms.user,
                                 group=TestForms.group.id,
-                                image='posts/new_small.gif').exists())
+                                image=stored_name(new_img, 'gif')).exists())
+
+
+@override_settings(IMAGE_MAX_SIZE=100)
+class TestImageNormalization(TestCase):
+    def upload(self, name, mode, size, image_format, **params):
+        content = BytesIO()
+        Image.new(mode, size).save(content, image_format, **params)
+        return SimpleUploadedFile(name, content.getvalue())
+
+    def noise(self, name, image_format, **params):
+        content = BytesIO()
+        Image.effect_noise((50, 50), 64).convert('RGB').save(
+            content, image_format, **params
+        )
+        return SimpleUploadedFile(name, content.getvalue())
+
+    def test_photo_is_turned_shrunk_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Camera'
+        result = normalize(self.upload(
+            'photo.jpeg', 'RGB', (400, 200), 'JPEG', exif=exif.tobytes()
+        ))
+        image = Image.open(result)
+        self.assertEqual(result.name, 'photo.jpg')
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.size, (50, 100))
+        self.assertNotIn('exif', image.info)
+
+    def test_transparent_image_stays_png(self):
+        result = normalize(
+            self.upload('logo.png', 'RGBA', (300, 300), 'PNG')
+        )
+        image = Image.open(result)
+        self.assertEqual(result.name, 'logo.png')
+        self.assertEqual(image.mode, 'RGBA')
+        self.assertEqual(image.size, (100, 100))
+
+    def test_opaque_png_becomes_jpeg(self):
+        result = normalize(self.noise('screen.png', 'PNG'))
+        self.assertEqual(result.name, 'screen.jpg')
+        self.assertEqual(Image.open(result).size, (50, 50))
+
+    def test_result_is_never_larger_than_the_upload(self):
+        for upload in (
+            self.upload('flat.png', 'RGB', (50, 50), 'PNG'),
+            self.noise('photo.jpg', 'JPEG', quality=30),
+        ):
+            with self.subTest(name=upload.name):
+                content = upload.read()
+                result = normalize(upload)
+                self.assertEqual(result.read(), content)
+                self.assertEqual(result.name, upload.name)
+
+    def test_metadata_is_stripped_from_kept_bytes(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        for upload in (
+            self.noise('photo.jpg', 'JPEG', quality=30, exif=exif.tobytes()),
+            self.upload('flat.png', 'RGB', (50, 50), 'PNG', exif=exif),
+        ):
+            with self.subTest(name=upload.name):
+                result = normalize(upload)
+                self.assertLess(result.size, upload.size)
+                image = Image.open(result)
+                self.assertEqual(image.format, Image.open(upload).format)
+                self.assertNotIn('exif', image.info)
+                image.load()
+
+    def test_unreadable_image_is_a_validation_error(self):
+        upload = self.noise('photo.jpg', 'JPEG')
+        truncated = SimpleUploadedFile(
+            'photo.jpg', upload.read()[:upload.size // 2]
+        )
+        with self.assertRaises(ValidationError):
+            normalize(truncated)
+
+    def test_profile_is_kept_only_for_its_colour_space(self):
+        def profile(space):
+            return bytes(16) + space + bytes(108)
+
+        for mode, space, kept in (
+            ('RGB', b'RGB ', True), ('CMYK', b'CMYK', False),
+        ):
+            with self.subTest(mode=mode):
+                result = normalize(self.upload(
+                    'photo.jpg', mode, (50, 50), 'JPEG',
+                    icc_profile=profile(space),
+                ))
+                image = Image.open(result)
+                self.assertEqual(image.mode, 'RGB')
+                self.assertEqual(
+                    image.info.get('icc_profile'),
+                    profile(space) if kept else None,
+                )
+
+    def test_gif_is_kept(self):
+        upload = self.upload('anim.gif', 'P', (300, 300), 'GIF')
+        self.assertIs(normalize(upload), upload)
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    THUMBNAIL_KVSTORE_FILE=os.path.join(TEMP_MEDIA_ROOT, 'thumbnails.sqlite3'),
+)
+class TestImageStorage(TransactionTestCase):
+    '''Files are deleted on commit, so these tests really commit.'''
+    img = SMALL_GIF
+    name = stored_name(SMALL_GIF, 'gif')
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='meme_lord')
+        self.auth_client = Client()
+        self.auth_client.force_login(self.user)
+        self.storage = Post._meta.get_field('image').storage
+
+    def upload(self, text, content=None):
+        self.auth_client.post(reverse('posts:post_create'), data={
+            'text': text,
+            'image': SimpleUploadedFile('meme.gif', content or self.img),
+        })
+        return Post.objects.get(text=text)
+
+    def refs(self, name):
+        image = StoredImage.objects.filter(name=name).first()
+        return image and image.refs
+
+    def test_same_image_is_stored_once(self):
+        first = self.upload('first')
+        second = self.upload('second')
+        self.assertEqual(first.image.name, self.name)
+        self.assertEqual(second.image.name, self.name)
+        self.assertEqual(self.refs(self.name), 2)
+        self.assertEqual(
+            len(self.storage.listdir(self.name.rsplit('/', 1)[0])[1]), 1
+        )
+
+    def test_file_is_kept_while_referenced(self):
+        first = self.upload('first')
+        second = self.upload('second')
+        first.delete()
+        self.assertEqual(self.refs(self.name), 1)
+        self.assertTrue(self.storage.exists(self.name))
+        second.delete()
+        self.assertIsNone(self.refs(self.name))
+        self.assertFalse(self.storage.exists(self.name))
+
+    def test_replaced_image_is_released(self):
+        post = self.upload('post')
+        other = self.img.replace(b'\xFF\xFF\xFF', b'\xFF\x00\x00')
+        self.auth_client.post(
+            reverse('posts:post_edit', args=(post.pk,)),
+            data={
+                'text': 'post',
+                'image': SimpleUploadedFile('other.gif', other),
+            },
+        )
+        self.assertIsNone(self.refs(self.name))
+        self.assertFalse(self.storage.exists(self.name))
+        self.assertEqual(self.refs(stored_name(other, 'gif')), 1)
+
+
+class TestContentAddressedStorage(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentAddressedStorage(location=directory.name)
+
+    def test_concurrent_upload_of_the_same_content_is_stored_once(self):
+        name = self.storage.save('posts/meme.gif', ContentFile(SMALL_GIF))
+        # The other upload checked before this file was written.
+        with mock.patch.object(
+            self.storage, 'exists', side_effect=[False, True]
+        ):
+            again = self.storage.save(
+                'posts/meme.gif', ContentFile(SMALL_GIF)
+            )
+        self.assertEqual(again, name)
+        self.assertEqual(name, stored_name(SMALL_GIF, 'gif'))
+        directory = os.path.dirname(name)
+        self.assertEqual(self.storage.listdir(directory)[1], [
+            os.path.basename(name)
+        ])
 
 
 class TestComment(TestCase):
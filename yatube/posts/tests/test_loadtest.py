@@ -0,0 +1,43 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from posts.seeding import Seeder
+
+
+class TestLoadtest(TransactionTestCase):
+    def setUp(self):
+        Seeder(random_seed=2).seed(
+            users=8, groups=2, posts=40, comments=20, follows=16
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = os.path.join(directory.name, 'loadtest.json')
+
+    def test_read_only_mix(self):
+        call_command(
+            'loadtest', threads=2, requests=40, users=3, read_only=True,
+            output=self.output, stdout=StringIO(),
+        )
+        with open(self.output) as file:
+            report = json.load(file)
+        self.assertEqual(report['requests'], 40)
+        self.assertEqual(report['statuses'], {'200': 40})
+        self.assertEqual(report['errors'], {})
+        self.assertNotIn('comment', report['scenarios'])
+        self.assertEqual(sum(report['histogram'].values()), 40)
+
+    def test_logged_in_writes_pass_csrf(self):
+        call_command(
+            'loadtest', threads=1, requests=10, users=2,
+            mix=['index=0', 'group=0', 'profile=0', 'post_detail=0',
+                 'comments=0', 'search=0', 'follow_index=0', 'follow=0'],
+            output=self.output, stdout=StringIO(),
+        )
+        with open(self.output) as file:
+            report = json.load(file)
+        self.assertEqual(report['statuses'], {'302': 10})
@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core.metrics import locked, registry
+
+User = get_user_model()
+INDEX = (('view', 'posts:index'),)
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(
+            METRICS_DIR=self.directory, METRICS_TOKEN='scrape-token'
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+
+    def scrape(self, **headers):
+        return self.client.get(
+            reverse('metrics'),
+            HTTP_AUTHORIZATION='Bearer scrape-token', **headers
+        )
+
+    def test_requests_are_counted_per_view(self):
+        before = registry.snapshot()
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('posts:index'))
+        delta = registry.snapshot() - before
+        self.assertEqual(
+            delta['yatube_requests_total', INDEX + (('status', '200'),)], 2
+        )
+        self.assertEqual(
+            delta['yatube_request_duration_seconds_bucket', INDEX + (
+                ('le', '+Inf'),
+            )], 2
+        )
+        self.assertGreater(delta['yatube_db_queries_total', INDEX], 0)
+        self.assertGreater(delta['yatube_cache_hits_total', INDEX], 0)
+
+    def test_other_processes_are_merged(self):
+        self.write_counters(os.getppid(), 7)
+        # A running worker holds its lock.
+        lock = os.path.join(self.directory, f'{os.getppid()}.lock')
+        with locked(lock):
+            response = self.scrape()
+        self.assertEqual(
+            response['Content-Type'],
+            'text/plain; version=0.0.4; charset=utf-8',
+        )
+        self.assertContains(response, '# TYPE yatube_requests_total counter')
+        self.assertContains(
+            response,
+            'yatube_requests_total{view="posts:other",status="500"} 7',
+        )
+        self.assertTrue(
+            os.path.exists(os.path.join(self.directory, f'{os.getpid()}.json'))
+        )
+
+    def test_buckets_are_cumulative(self):
+        self.client.get(reverse('posts:index'))
+        lines = [
+            line for line in self.scrape().content.decode().splitlines()
+            if line.startswith('yatube_request_duration_seconds_bucket'
+                               '{view="posts:index"')
+        ]
+        counts = [float(line.rsplit(' ', 1)[1]) for line in lines]
+        self.assertIn('le="+Inf"', lines[-1])
+        self.assertEqual(counts, sorted(counts))
+
+    def write_counters(self, pid, requests):
+        path = os.path.join(self.directory, f'{pid}.json')
+        with open(path, 'w') as file:
+            json.dump([[
+                'yatube_requests_total',
+                {'view': 'posts:other', 'status': '500'}, requests,
+            ]], file)
+        return path
+
+    def test_counters_of_gone_workers_are_archived(self):
+        # The pid is running, but no worker holds its lock.
+        path = self.write_counters(os.getppid(), 3)
+        series = 'yatube_requests_total{view="posts:other",status="500"}'
+        self.assertContains(self.scrape(), f'{series} 3')
+        self.assertFalse(os.path.exists(path))
+        self.assertContains(self.scrape(), f'{series} 3')
+        self.write_counters(os.getppid(), 2)
+        self.assertContains(self.scrape(), f'{series} 5')
+
+    def test_files_left_under_a_reused_pid_are_archived(self):
+        self.write_counters(os.getpid(), 4)
+        registry.flush(force=True)
+        self.assertContains(
+            self.scrape(),
+            'yatube_requests_total{view="posts:other",status="500"} 4',
+        )
+
+    def test_hidden_without_token_or_staff(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 404)
+        with override_settings(METRICS_TOKEN=None):
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer ')
+            self.assertEqual(response.status_code, 404)
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 200)
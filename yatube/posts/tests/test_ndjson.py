@@ -0,0 +1,114 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import AuthorStats, Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class TestNdjson(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='group', slug='group', description='description'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Первый пост'
+        )
+        Post.objects.create(author=cls.reader, text='чужой пост')
+        Comment.objects.create(
+            post=cls.post, author=cls.reader, text='комментарий'
+        )
+        Follow.objects.create(user=cls.author, author=cls.reader)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'export.ndjson.gz')
+        self.client = Client()
+        self.client.force_login(TestNdjson.author)
+        self.url = reverse('posts:profile_export', args=('author',))
+
+    def test_export_import_round_trip(self):
+        call_command('export_ndjson', output=self.path, gzip=True)
+        with gzip.open(self.path) as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(
+            [record['model'] for record in records],
+            ['post', 'post', 'comment', 'follow'],
+        )
+        pub_date = self.post.pub_date
+        Post.objects.all().delete()
+        Follow.objects.all().delete()
+        out = StringIO()
+        call_command('import_ndjson', self.path, batch_size=2, stdout=out)
+        self.assertIn('post: 2 rows read', out.getvalue())
+        restored = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(restored.pub_date, pub_date)
+        self.assertEqual(restored.text, 'Первый пост')
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(Follow.objects.count(), 1)
+        stats = AuthorStats.objects.get(user=self.author)
+        self.assertEqual((stats.posts_count, stats.following_count), (1, 1))
+
+    def test_import_keeps_existing_rows(self):
+        call_command('export_ndjson', output=self.path, gzip=True)
+        moved = self.post.pub_date - timedelta(days=1)
+        Post.objects.filter(pk=self.post.pk).update(pub_date=moved)
+        call_command('import_ndjson', self.path, stdout=StringIO())
+        self.assertEqual(Post.objects.get(pk=self.post.pk).pub_date, moved)
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+
+    def test_broken_records_are_reported(self):
+        for line in ('{"model": "post",', '[1, 2]', '"post"', '{}'):
+            with self.subTest(line=line):
+                with open(self.path, 'w') as file:
+                    file.write(line + '\n')
+                with self.assertRaisesMessage(CommandError, 'Broken record'):
+                    call_command('import_ndjson', self.path, stdout=StringIO())
+
+    def test_author_export_streams_own_rows(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [(record['model'], record['id']) for record in records],
+            [
+                ('post', self.post.pk),
+                ('comment', self.post.comments.get().pk),
+                ('follow', Follow.objects.get().pk),
+            ],
+        )
+
+    def test_author_export_gzip(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        content = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(len(content.splitlines()), 3)
+        plain = self.client.get(self.url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+    def test_only_the_author_can_export(self):
+        reader = Client()
+        reader.force_login(TestNdjson.reader)
+        self.assertRedirects(
+            reader.get(self.url), reverse('posts:profile', args=('author',))
+        )
+        response = Client().get(self.url)
+        self.assertRedirects(response, f'/auth/login/?next={self.url}')
@@ -0,0 +1,59 @@
+import re
+import time
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from core.profiling import Profile, current_profile, phase
+
+User = get_user_model()
+TIMING = re.compile(r'(\w+);dur=([\d.]+)')
+
+
+class TestProfile(SimpleTestCase):
+    def test_nested_phases_are_exclusive(self):
+        profile = Profile()
+        token = current_profile.set(profile)
+        try:
+            with phase('tpl'):
+                time.sleep(0.01)
+                with phase('db'):
+                    time.sleep(0.02)
+        finally:
+            current_profile.reset(token)
+        profile.finish()
+        self.assertAlmostEqual(profile.times['tpl'], 0.01, delta=0.005)
+        self.assertAlmostEqual(profile.times['db'], 0.02, delta=0.005)
+        self.assertGreaterEqual(profile.times['app'], 0)
+
+    def test_phase_without_request_is_ignored(self):
+        with phase('db'):
+            pass
+
+
+@override_settings(PROFILING_HEADER=True)
+class TestProfilingMiddleware(TestCase):
+    def test_server_timing_header(self):
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('posts:index'))
+        timings = dict(TIMING.findall(response['Server-Timing']))
+        self.assertEqual(
+            set(timings), {'db', 'tpl', 'thumb', 'app', 'total'}
+        )
+        self.assertGreater(float(timings['tpl']), 0)
+        self.assertRegex(response['Server-Timing'], r'desc="\d+ queries"')
+
+    def test_server_timing_is_only_sent_to_staff(self):
+        self.assertNotIn('Server-Timing', self.client.get('/'))
+        user = User.objects.create_user(username='user')
+        self.client.force_login(user)
+        self.assertNotIn('Server-Timing', self.client.get('/'))
+
+    @override_settings(PROFILING_HEADER=False, PROFILING_LOG=True)
+    def test_log_line(self):
+        with self.assertLogs('core.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('posts:index'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertRegex(logs.output[0], r'posts:index 200 total=')
@@ -0,0 +1,221 @@
+from io import BytesIO, StringIO
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings
+)
+from django.urls import reverse
+from PIL import Image
+
+from core.testing import QueryBudgetMixin
+from posts.management.commands.index_advisor import suggested_index
+from posts.models import Comment, Follow, Group, Post, StoredImage
+from posts.urls import urlpatterns
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+def photo(name):
+    content = BytesIO()
+    Image.effect_noise((50, 50), 64).convert('RGB').save(content, 'JPEG')
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+class TestQueryBudgets(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='test group',
+            slug='test-slug',
+            description='test description',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(12):
+            cls.post = Post.objects.create(
+                author=cls.author, group=cls.group, text=f'post {i}'
+            )
+        for i in range(5):
+            commentator = User.objects.create_user(username=f'reader{i}')
+            Comment.objects.create(
+                post=cls.post, author=commentator, text=f'comment {i}'
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(TestQueryBudgets.reader)
+
+    def test_every_route_has_a_budget(self):
+        for pattern in urlpatterns:
+            with self.subTest(route=pattern.name):
+                self.assertIn(f'posts:{pattern.name}', settings.QUERY_BUDGETS)
+
+    def test_views_stay_within_budget(self):
+        post_id = TestQueryBudgets.post.pk
+        username = TestQueryBudgets.author.username
+        routes = {
+            'posts:index': reverse('posts:index'),
+            'posts:group_list': reverse(
+                'posts:group_list', args=(TestQueryBudgets.group.slug,)
+            ),
+            'posts:profile': reverse('posts:profile', args=(username,)),
+            'posts:post_detail': reverse(
+                'posts:post_detail', args=(post_id,)
+            ),
+            'posts:post_create': reverse('posts:post_create'),
+            'posts:post_edit': reverse('posts:post_edit', args=(post_id,)),
+            'posts:add_comment': reverse(
+                'posts:add_comment', args=(post_id,)
+            ),
+            'posts:comment_list': reverse(
+                'posts:comment_list', args=(post_id,)
+            ),
+            'posts:search': reverse('posts:search') + '?q=post',
+            'posts:follow_index': reverse('posts:follow_index'),
+            'posts:profile_follow': reverse(
+                'posts:profile_follow', args=(username,)
+            ),
+            'posts:profile_unfollow': reverse(
+                'posts:profile_unfollow', args=(username,)
+            ),
+        }
+        for view_name, url in routes.items():
+            with self.subTest(view_name=view_name):
+                self.assertWithinQueryBudget(view_name, self.client, url)
+
+    def test_feed_queries_do_not_scan_tables(self):
+        out = StringIO()
+        call_command('index_advisor', username='reader', repeat=1, stdout=out)
+        self.assertNotIn('full scan', out.getvalue())
+
+    def test_advisor_suggests_the_missing_index(self):
+        sql = (
+            'SELECT "posts_post"."id" FROM "posts_post" '
+            'WHERE "posts_post"."group_id" = %s '
+            'ORDER BY "posts_post"."pub_date" DESC LIMIT 10'
+        )
+        plan = ['SCAN posts_post', 'USE TEMP B-TREE FOR ORDER BY']
+        self.assertEqual(suggested_index(sql, plan), (
+            Post,
+            "models.Index(fields=('group', '-pub_date'), "
+            "name='post_group_pub_date_idx')",
+        ))
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    THUMBNAIL_KVSTORE_FILE=os.path.join(TEMP_MEDIA_ROOT, 'thumbnails.sqlite3'),
+    THUMBNAIL_PREGENERATE=False,
+    TIMELINE_FANOUT_LIMIT=1,
+)
+class TestWriteBudgets(QueryBudgetMixin, TransactionTestCase):
+    '''Writes commit here, so BEGIN is counted as in production.'''
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.popular = User.objects.create_user(username='popular')
+        self.group = Group.objects.create(
+            title='test group',
+            slug='test-slug',
+            description='test description',
+        )
+        for i in range(2):
+            fan = User.objects.create_user(username=f'fan{i}')
+            Follow.objects.create(user=fan, author=self.popular)
+        for i in range(12):
+            Post.objects.create(author=self.popular, text=f'popular {i}')
+            self.post = Post.objects.create(
+                author=self.author, group=self.group, text=f'post {i}'
+            )
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_writes_stay_within_budget(self):
+        author_client = Client()
+        author_client.force_login(self.author)
+        follow = reverse('posts:profile_follow', args=('author',))
+        writes = (
+            ('posts:profile_follow', self.client, follow, {}),
+            ('posts:profile_follow', self.client, reverse(
+                'posts:profile_follow', args=('popular',)
+            ), {}),
+            ('posts:post_create', author_client, reverse(
+                'posts:post_create'
+            ), {
+                'text': 'new post',
+                'group': self.group.pk,
+                'image': photo('new.jpg'),
+            }),
+            ('posts:post_edit', author_client, reverse(
+                'posts:post_edit', args=(self.post.pk,)
+            ), {'text': 'edited post', 'group': self.group.pk}),
+            ('posts:add_comment', self.client, reverse(
+                'posts:add_comment', args=(self.post.pk,)
+            ), {'text': 'new comment'}),
+            ('posts:profile_unfollow', self.client, reverse(
+                'posts:profile_unfollow', args=('author',)
+            ), {}),
+        )
+        for view_name, client, url, data in writes:
+            with self.subTest(view_name=view_name, url=url):
+                response = self.assertWithinQueryBudget(
+                    view_name, client, url, data
+                )
+                self.assertEqual(response.status_code, 302)
+        self.assertTrue(Post.objects.filter(text='edited post').exists())
+        self.assertTrue(Comment.objects.filter(text='new comment').exists())
+        self.assertEqual(
+            list(self.reader.follower.values_list('author__username')),
+            [('popular',)],
+        )
+
+    def test_image_edits_stay_within_budget(self):
+        author_client = Client()
+        author_client.force_login(self.author)
+        edit = reverse('posts:post_edit', args=(self.post.pk,))
+        for name in ('first.jpg', 'second.jpg'):
+            with self.subTest(image=name):
+                response = self.assertWithinQueryBudget(
+                    'posts:post_edit', author_client, edit, {
+                        'text': 'edited post',
+                        'group': self.group.pk,
+                        'image': photo(name),
+                    }
+                )
+                self.assertEqual(response.status_code, 302)
+        self.assertEqual(StoredImage.objects.get().refs, 1)
+
+    def test_merged_follow_feed_stays_within_budget(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=self.popular)
+        feed = reverse('posts:follow_index')
+        for url in (feed, feed + '?page=2', feed + '?page=3'):
+            with self.subTest(url=url):
+                response = self.assertWithinQueryBudget(
+                    'posts:follow_index', self.client, url
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context['page_obj'])
+        cache.clear()
+        response = self.assertWithinQueryBudget(
+            'api:follow_index', self.client, reverse('api:follow_index')
+        )
+        self.assertEqual(response.status_code, 200)
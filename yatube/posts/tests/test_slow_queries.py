@@ -0,0 +1,68 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core.models import SlowQuery
+from core.slow_queries import SlowQueryLog, normalize
+from posts.models import Post
+
+User = get_user_model()
+
+
+class TestSlowQueries(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        Post.objects.create(author=cls.admin, text='пост')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalize(
+                "SELECT  *\n FROM t WHERE id IN (%s, %s) AND a = 'x' LIMIT 10"
+            ),
+            'SELECT * FROM t WHERE id IN (...) AND a = ? LIMIT ?',
+        )
+
+    def test_off_by_default(self):
+        self.client.get(reverse('posts:index'))
+        self.assertFalse(SlowQuery.objects.exists())
+
+    @override_settings(SLOW_QUERY_LOG=True, SLOW_QUERY_THRESHOLD_MS=0)
+    def test_queries_over_threshold_are_recorded(self):
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            self.client.get(reverse('posts:index'))
+            self.client.get(reverse('posts:index') + '?page=1')
+        queries = SlowQuery.objects.filter(view_name='posts:index')
+        self.assertTrue(queries.exists())
+        self.assertTrue(queries.filter(count__gte=2).exists())
+        stacks = '\n'.join(queries.values_list('stack', flat=True))
+        self.assertIn('template posts/index.html:', stacks)
+        self.assertIn('posts/views.py:', stacks)
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_SAMPLE_RATE=1)
+    def test_rows_are_only_recorded_for_writes(self):
+        log = SlowQueryLog()
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            with connection.execute_wrapper(log):
+                list(Post.objects.all())
+                Post.objects.update(text='изменён')
+        self.assertEqual([record['rows'] for record in log.records], [None, 1])
+
+    def test_admin_lists_offenders(self):
+        SlowQuery.objects.create(
+            fingerprint='a' * 40, sql='SELECT ?', count=3, total_ms=900,
+            max_ms=500, view_name='posts:index',
+        )
+        self.client.force_login(self.admin)
+        response = self.client.get(
+            reverse('admin:core_slowquery_changelist')
+        )
+        self.assertContains(response, 'SELECT ?')
@@ -0,0 +1,78 @@
+import os
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from posts import thumbnails
+from posts.thumbnails import TieredKVStore, submit_thumbnails
+
+
+class TestTieredKVStore(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            THUMBNAIL_KVSTORE_FILE=os.path.join(directory.name, 'kv.sqlite3'),
+            THUMBNAIL_LRU_SIZE=2,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.store = TieredKVStore()
+
+    def test_lookups_are_counted(self):
+        self.store._set_raw('a', '1')
+        self.assertEqual(self.store._get_raw('a'), '1')
+        self.assertIsNone(self.store._get_raw('b'))
+        stats = self.store.stats()
+        self.assertEqual(stats['lru_hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_evicted_keys_are_read_from_the_file(self):
+        for key in 'abc':
+            self.store._set_raw(key, key.upper())
+        self.assertEqual(self.store.stats()['lru_size'], 2)
+        self.assertEqual(self.store._get_raw('a'), 'A')
+        self.assertEqual(self.store.stats()['file_hits'], 1)
+        self.assertEqual(self.store._get_raw('a'), 'A')
+        self.assertEqual(self.store.stats()['lru_hits'], 1)
+
+    def test_file_is_shared_between_stores(self):
+        self.store._set_raw('sorl||image||a', '1')
+        self.store._set_raw('other||image||b', '2')
+        other = TieredKVStore()
+        self.assertEqual(other._get_raw('sorl||image||a'), '1')
+        self.assertEqual(other._find_keys_raw('sorl||'), ['sorl||image||a'])
+        other._delete_raw('sorl||image||a')
+        self.assertIsNone(other._get_raw('sorl||image||a'))
+
+
+class TestSubmitThumbnails(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(thumbnails, '_executor', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_broken_pool_is_replaced(self):
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool('worker died')
+        thumbnails._executor = broken
+        fresh = mock.Mock()
+        with mock.patch.object(thumbnails, 'worker_pool', return_value=fresh):
+            with self.assertLogs('posts.thumbnails', 'ERROR'):
+                submit_thumbnails('posts/a.jpg')
+        broken.shutdown.assert_called_once_with(wait=False)
+        fresh.submit.assert_called_once_with(
+            thumbnails.render_thumbnails, 'posts/a.jpg'
+        )
+        self.assertIs(thumbnails._executor, fresh)
+
+    def test_unusable_pool_does_not_raise(self):
+        pool = mock.Mock()
+        pool.submit.side_effect = RuntimeError('cannot schedule new futures')
+        with mock.patch.object(thumbnails, 'worker_pool', return_value=pool):
+            with self.assertLogs('posts.thumbnails', 'ERROR') as logs:
+                submit_thumbnails('posts/a.jpg')
+        self.assertEqual(len(logs.output), 2)
+        self.assertIsNone(thumbnails._executor)
@@ -1,20 +1,40 @@
+import os
+import re
 import tempfile
 import shutil
+from io import StringIO
+from unittest import mock
 
 from django import forms
 from django.urls import reverse
-from django.test import TestCase, Client, override_settings
+from django.test import (
+    TestCase, TransactionTestCase, Client, override_settings
+)
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-
-from posts.models import Group, Post, Comment, Follow
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
+
+from posts.models import (
+    AuthorStats, Group, Post, Comment, Follow, Timeline
+)
+from posts.search import SYNC_TRIGGERS
+from posts.stats import recount, stats_for
+from posts.templatetags.feed_tags import page_window
+from posts.utils import bump_feed_version, card_cache_key
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 User = get_user_model()
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    THUMBNAIL_KVSTORE_FILE=os.path.join(TEMP_MEDIA_ROOT, 'thumbnails.sqlite3'),
+)
 class TestPostViews(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -171,18 +191,55 @@ class TestPostViews(TestCase):
             author=TestPostViews.post.author,
         ).exists())
 
+    @override_settings(COMMENTS_PER_PAGE=2)
+    def test_comments_are_loaded_in_batches(self):
+        for i in range(3):
+            Comment.objects.create(
+                post=TestPostViews.post,
+                author=TestPostViews.user,
+                text=f'comment {i}'
+            )
+        response = self.guest_client.get(
+            reverse('posts:post_detail', args=(TestPostViews.post.id,))
+        )
+        comments = response.context['comments']
+        self.assertEqual(
+            [comment.text for comment in comments],
+            ['comment 0', 'comment 1']
+        )
+        response = self.guest_client.get(
+            reverse('posts:comment_list', args=(TestPostViews.post.id,)),
+            {'after': comments.next_cursor}
+        )
+        self.assertTemplateUsed(response, 'includes/comment_list.html')
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            ['comment 2']
+        )
+        self.assertFalse(response.context['comments'].has_next())
+
     def test_cache(self):
         response_1 = self.guest_client.get(
             reverse('posts:index')
         )
         cache_1 = response_1.content
-        Post.objects.get(pk=1).delete()
+        Post.objects.filter(pk=TestPostViews.post.pk).update(text='changed')
         response_2 = self.guest_client.get(
             reverse('posts:index')
         )
         cache_2 = response_2.content
         self.assertEqual(cache_1, cache_2)
 
+    def test_cache_expires_on_post_changes(self):
+        url = reverse('posts:index')
+        self.guest_client.get(url)
+        post = Post.objects.create(
+            author=TestPostViews.user, text='brand new post'
+        )
+        self.assertContains(self.guest_client.get(url), 'brand new post')
+        post.delete()
+        self.assertNotContains(self.guest_client.get(url), 'brand new post')
+
     def test_follow_index(self):
         response = self.auth_client.get(
             reverse('posts:follow_index')
@@ -249,6 +306,24 @@ class TestPostViews(TestCase):
         )
         self.check_post(response.context.get('post_detail'))
 
+    def test_pregenerated_thumbnails_are_reused(self):
+        call_command('pregenerate_thumbnails', workers=1, stdout=StringIO())
+        thumbnails = self.thumbnail_files()
+        self.assertEqual(len(thumbnails), 2)
+        cache.clear()
+        self.guest_client.get(reverse('posts:index'))
+        self.guest_client.get(
+            reverse('posts:post_detail', args=(self.post.id,))
+        )
+        self.assertEqual(self.thumbnail_files(), thumbnails)
+
+    def thumbnail_files(self):
+        return sorted(
+            name for _, _, files
+            in os.walk(os.path.join(TEMP_MEDIA_ROOT, 'cache'))
+            for name in files
+        )
+
     def check_post(self, post):
         self.assertEqual(post.text, TestPostViews.post.text)
         self.assertEqual(post.author, TestPostViews.post.author)
@@ -274,8 +349,10 @@ class TestPaginator(TestCase):
                 group=cls.group
             ))
         Post.objects.bulk_create(TestPaginator.post)
+        recount([cls.author.pk])
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
 
     def tets_first_page(self):
@@ -317,6 +394,293 @@ class TestPaginator(TestCase):
                     count - settings.MAX_POSTS
                 )
 
+    def test_cached_pages_differ(self):
+        url = reverse('posts:index')
+        first_page = self.guest_client.get(url).content
+        second_page = self.guest_client.get(url, {'page': 2}).content
+        self.assertNotEqual(first_page, second_page)
+
+    def test_cursor_pages(self):
+        url = reverse('posts:index')
+        first_page = self.guest_client.get(url).context['page_obj']
+        cursor = first_page.paginator.cursor_for(first_page[-1])
+        response = self.guest_client.get(url, {'after': cursor})
+        second_page = response.context['page_obj']
+        self.assertEqual(
+            len(second_page), len(TestPaginator.post) - settings.MAX_POSTS
+        )
+        self.assertFalse(second_page.has_next())
+        self.assertTrue(set(first_page).isdisjoint(second_page))
+        response = self.guest_client.get(
+            url, {'before': second_page.previous_cursor}
+        )
+        self.assertEqual(
+            list(response.context['page_obj']), list(first_page)
+        )
+
+    def test_post_counter_follows_saves_and_deletes(self):
+        url = reverse(
+            'posts:profile', kwargs={'username': TestPaginator.author.username}
+        )
+        response = self.guest_client.get(url)
+        self.assertEqual(response.context['post_count'], 15)
+        post = Post.objects.create(text='new post', author=self.author)
+        response = self.guest_client.get(url)
+        self.assertEqual(response.context['post_count'], 16)
+        self.assertEqual(response.context['page_obj'].paginator.count, 16)
+        post.delete()
+        Post.objects.filter(pk=TestPaginator.post[0].pk).update(text='-')
+        with self.assertNumQueries(0):
+            count = response.context['page_obj'].paginator.count
+        self.assertEqual(count, 16)
+        response = self.guest_client.get(url)
+        self.assertEqual(response.context['post_count'], 15)
+        self.assertEqual(response.context['page_obj'].paginator.count, 15)
+
+    def test_page_window(self):
+        paginator = Paginator(range(100), 1)
+        self.assertEqual(
+            page_window(paginator.page(50)),
+            [1, None, 48, 49, 50, 51, 52, None, 100]
+        )
+        self.assertEqual(
+            page_window(paginator.page(2)), [1, 2, 3, 4, None, 100]
+        )
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.guest_client.get(
+            reverse('posts:index'), {'after': 'not-a-cursor'}
+        )
+        self.assertEqual(
+            len(response.context['page_obj']), settings.MAX_POSTS
+        )
+
+
+class TestConditionalGet(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='etag')
+        cls.reader = User.objects.create(username='reader')
+        cls.group = Group.objects.create(
+            title='etag group',
+            slug='etag-slug',
+            description='etag description'
+        )
+        cls.post = Post.objects.create(
+            text='etag text', author=cls.author, group=cls.group
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.auth_client = Client()
+        self.auth_client.force_login(TestConditionalGet.reader)
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.author.username,)),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+        )
+
+    def assertNotModified(self, client, url, etag, modified=False):
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200 if modified else 304)
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.guest_client.get(url)['ETag']
+                self.assertNotModified(self.guest_client, url, etag)
+                self.assertNotModified(
+                    self.guest_client, url + '?page=2', etag, modified=True
+                )
+                self.assertNotModified(
+                    self.auth_client, url, etag, modified=True
+                )
+
+    def test_new_and_edited_posts_change_pages(self):
+        etags = [self.guest_client.get(url)['ETag'] for url in self.urls]
+        post = Post.objects.create(
+            text='new', author=self.author, group=self.group
+        )
+        for url, etag in zip(self.urls[:3], etags):
+            with self.subTest(url=url):
+                self.assertNotModified(
+                    self.guest_client, url, etag, modified=True
+                )
+        etag = self.guest_client.get(self.urls[3])['ETag']
+        post.text = 'edited'
+        post.save()
+        self.assertNotModified(
+            self.guest_client, self.urls[3], etag, modified=True
+        )
+
+    def test_comment_and_follow_change_pages(self):
+        detail, profile = self.urls[3], self.urls[2]
+        etag = self.auth_client.get(detail)['ETag']
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='comment'
+        )
+        self.assertNotModified(self.auth_client, detail, etag, modified=True)
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='newer comment'
+        )
+        etag = self.auth_client.get(detail)['ETag']
+        Comment.objects.get(text='comment').delete()
+        self.assertNotModified(self.auth_client, detail, etag, modified=True)
+        etag = self.auth_client.get(profile)['ETag']
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertNotModified(
+            self.auth_client, profile, etag, modified=True
+        )
+
+    def test_not_modified_skips_rendering(self):
+        # Index and group pages are validated by the feed version alone.
+        for url, queries in zip(self.urls, (0, 0, 1, 1)):
+            with self.subTest(url=url):
+                etag = self.guest_client.get(url)['ETag']
+                with self.assertNumQueries(queries):
+                    self.assertNotModified(self.guest_client, url, etag)
+
+
+class TestPostCards(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='carder')
+        cls.group = Group.objects.create(
+            title='cards', slug='cards', description='cards'
+        )
+        cls.post = Post.objects.create(
+            text='Карточка поста', author=cls.author, group=cls.group
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cards_are_shared_between_feeds(self):
+        self.client.get(reverse('posts:index'))
+        key = card_cache_key(self.post, 'feed')
+        self.assertIn('Карточка поста', cache.get(key))
+        cache.set(key, 'из кэша')
+        bump_feed_version()
+        self.assertContains(self.client.get(reverse('posts:index')), 'из кэша')
+
+    def test_saved_post_gets_a_new_card(self):
+        self.client.get(reverse('posts:group_list', args=(self.group.slug,)))
+        old_key = card_cache_key(self.post, 'group')
+        self.post.text = 'Новый текст'
+        self.post.save()
+        self.assertNotEqual(card_cache_key(self.post, 'group'), old_key)
+        response = self.client.get(
+            reverse('posts:group_list', args=(self.group.slug,))
+        )
+        self.assertContains(response, 'Новый текст')
+
+    def test_renamed_author_gets_a_new_card(self):
+        post = Post.objects.select_related('author').get(pk=self.post.pk)
+        old_key = card_cache_key(post, 'profile')
+        post.author.first_name = 'Иван'
+        self.assertNotEqual(card_cache_key(post, 'profile'), old_key)
+
+
+class TestSearch(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='searcher')
+        cls.rare = Post.objects.create(
+            text='Котики и собаки', author=cls.author
+        )
+        cls.often = Post.objects.create(
+            text='Котики, котики и ещё раз котики', author=cls.author
+        )
+        Post.objects.bulk_create([
+            Post(text=f'Пост про погоду № {i}', author=cls.author)
+            for i in range(15)
+        ])
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def search(self, query, **params):
+        response = self.guest_client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+        return response.context['page_obj']
+
+    def test_best_match_comes_first(self):
+        page_obj = self.search('котики')
+        self.assertEqual(
+            list(page_obj), [TestSearch.often, TestSearch.rare]
+        )
+
+    def test_last_word_matches_prefix(self):
+        self.assertEqual(list(self.search('соба')), [TestSearch.rare])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.create(text='Жираф', author=TestSearch.author)
+        self.assertEqual(list(self.search('жираф')), [post])
+        post.text = 'Слон'
+        post.save()
+        self.assertEqual(list(self.search('жираф')), [])
+        self.assertEqual(list(self.search('слон')), [post])
+        post.delete()
+        self.assertEqual(list(self.search('слон')), [])
+
+    def test_query_syntax_is_not_passed_through(self):
+        for query in ('"', 'NOT', 'AND OR', '*', '', 'котики)'):
+            with self.subTest(query=query):
+                response = self.guest_client.get(
+                    reverse('posts:search'), {'q': query}
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_pages_keep_the_query(self):
+        page_obj = self.search('погоду', page=2)
+        self.assertEqual(page_obj.paginator.count, 15)
+        self.assertEqual(len(page_obj), 15 - settings.MAX_POSTS)
+        response = self.guest_client.get(
+            reverse('posts:search'), {'q': 'погоду'}
+        )
+        self.assertContains(response, '?q=%D0%BF%D0%BE%D0%B3%D0%BE%D0%B4')
+
+    def test_rebuild_search_index(self):
+        call_command('rebuild_search_index', chunk_size=5, stdout=StringIO())
+        self.assertEqual(self.search('погоду').paginator.count, 15)
+
+    def test_migrated_triggers_match_the_app_copy(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+                "AND tbl_name = 'posts_post'"
+            )
+            migrated = dict(cursor.fetchall())
+        self.assertEqual(migrated, {
+            name: f'CREATE TRIGGER {name} {body}'
+            for name, body in SYNC_TRIGGERS.items()
+        })
+
+    def test_rebuild_restores_dropped_triggers(self):
+        with connection.cursor() as cursor:
+            for name in SYNC_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER {name}')
+        call_command('rebuild_search_index', stdout=StringIO())
+        Post.objects.create(text='Снова ищется', author=TestSearch.author)
+        self.assertEqual(self.search('ищется').paginator.count, 1)
+
+    def test_failed_rebuild_keeps_the_old_index(self):
+        class BrokenOutput(StringIO):
+            def write(self, text):
+                raise OSError('output closed')
+
+        with self.assertRaises(OSError):
+            call_command(
+                'rebuild_search_index', chunk_size=5, stdout=BrokenOutput()
+            )
+        self.assertEqual(self.search('погоду').paginator.count, 15)
+
 
 class TetsFollow(TestCase):
     def setUp(self) -> None:
@@ -354,3 +718,136 @@ class TetsFollow(TestCase):
             )
         )
         self.assertEqual(Follow.objects.all().count(), 0)
+
+    def test_new_post_is_fanned_out_to_followers(self):
+        Follow.objects.create(user=self.follower, author=self.following)
+        post = Post.objects.create(author=self.following, text='new text')
+        self.assertTrue(
+            Timeline.objects.filter(user=self.follower, post=post).exists()
+        )
+        response = self.auth_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [post, self.post])
+        Follow.objects.all().delete()
+        self.assertFalse(Timeline.objects.exists())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_posts_of_popular_authors_are_merged_on_read(self):
+        Follow.objects.create(user=self.follower, author=self.following)
+        Post.objects.create(author=self.following, text='new text')
+        self.assertFalse(Timeline.objects.exists())
+        response = self.auth_client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 2)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_timeline_and_popular_authors_are_paged_in_order(self):
+        popular = User.objects.create(username='popular')
+        Follow.objects.create(user=self.follower, author=self.following)
+        Follow.objects.create(user=self.follower, author=popular)
+        Follow.objects.create(user=self.following, author=popular)
+        posts = [
+            Post.objects.create(author=author, text=f'post {i}')
+            for i in range(12)
+            for author in (self.following, popular)
+        ]
+        self.assertFalse(Timeline.objects.filter(
+            post__author=popular
+        ).exists())
+        expected = sorted(
+            posts + [self.post], key=lambda post: (post.pub_date, post.pk),
+            reverse=True,
+        )
+        url = reverse('posts:follow_index')
+        first = self.auth_client.get(url).context['page_obj']
+        self.assertEqual(list(first), expected[:settings.MAX_POSTS])
+        self.assertEqual(first.paginator.count, 25)
+        second = self.auth_client.get(
+            url, {'after': first.paginator.cursor_for(first[len(first) - 1])}
+        ).context['page_obj']
+        self.assertEqual(
+            list(second), expected[settings.MAX_POSTS:2 * settings.MAX_POSTS]
+        )
+        with CaptureQueriesContext(connection) as queries:
+            numbered = self.auth_client.get(
+                url, {'page': 3}
+            ).context['page_obj']
+        self.assertEqual(list(numbered), expected[2 * settings.MAX_POSTS:])
+        limits = [
+            int(limit) for query in queries
+            for limit in re.findall(r'LIMIT (\d+)', query['sql'])
+        ]
+        self.assertLessEqual(max(limits), settings.MAX_POSTS)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_author_back_under_the_limit_is_fanned_out(self):
+        other = User.objects.create(username='other')
+        Follow.objects.create(user=self.follower, author=self.following)
+        Follow.objects.create(user=other, author=self.following)
+        self.assertFalse(Timeline.objects.exists())
+        post = Post.objects.create(author=self.following, text='while popular')
+        Follow.objects.filter(user=other).delete()
+        self.assertEqual(
+            set(Timeline.objects.filter(user=self.follower).values_list(
+                'post', flat=True
+            )),
+            {self.post.pk, post.pk},
+        )
+
+    def test_follow_feed_count_is_cached(self):
+        Follow.objects.create(user=self.follower, author=self.following)
+        url = reverse('posts:follow_index')
+        self.assertEqual(
+            self.auth_client.get(url).context['page_obj'].paginator.count, 1
+        )
+        Post.objects.create(author=self.following, text='new text')
+        page_obj = self.auth_client.get(url).context['page_obj']
+        with self.assertNumQueries(0):
+            self.assertEqual(page_obj.paginator.count, 2)
+
+    def test_rebuild_timelines(self):
+        Follow.objects.create(user=self.follower, author=self.following)
+        Timeline.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(
+            Timeline.objects.filter(user=self.follower).get().post,
+            self.post
+        )
+
+    def test_counters_follow_posts_and_follows(self):
+        Follow.objects.create(user=self.follower, author=self.following)
+        response = self.auth_client.get(
+            reverse('posts:profile', args=(self.following.username,))
+        )
+        self.assertEqual(response.context['post_count'], 1)
+        self.assertEqual(response.context['followers_count'], 1)
+        self.assertEqual(self.follower.stats.following_count, 1)
+        Follow.objects.all().delete()
+        self.post.delete()
+        stats = AuthorStats.objects.get(user=self.following)
+        self.assertEqual((stats.posts_count, stats.followers_count), (0, 0))
+
+    def test_recount_fixes_drift(self):
+        AuthorStats.objects.filter(user=self.following).update(posts_count=7)
+        call_command('recount', stdout=StringIO())
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.following).posts_count, 1
+        )
+
+
+class TestCounterTransactions(TransactionTestCase):
+    def test_counters_roll_back_with_the_write(self):
+        author = User.objects.create(username='author')
+        reader = User.objects.create(username='reader')
+        Post.objects.create(text='kept post', author=author)
+        with mock.patch(
+            'posts.timeline.fan_out', side_effect=DatabaseError
+        ), self.assertRaises(DatabaseError):
+            Post.objects.create(text='lost post', author=author)
+        with mock.patch(
+            'posts.timeline.backfill', side_effect=DatabaseError
+        ), self.assertRaises(DatabaseError):
+            Follow.objects.create(user=reader, author=author)
+        self.assertFalse(Post.objects.filter(text='lost post').exists())
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(stats_for(author).posts_count, 1)
+        self.assertEqual(stats_for(author).followers_count, 0)
+        self.assertEqual(stats_for(reader).following_count, 0)
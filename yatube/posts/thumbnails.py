@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import transaction
+from sorl.thumbnail.kvstores.base import KVStoreBase
+
+logger = logging.getLogger(__name__)
+
+# Geometries and options of the {% thumbnail %} tags in the post templates,
+# they have to match exactly for the pre-generated files to be picked up.
+FEED_THUMBNAILS = (
+    ('1280x959', {'crop': 'center', 'upscale': True}),
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+
+_executor = None
+
+
+class WorkerKVStore(KVStoreBase):
+    '''Throwaway store of a worker process.
+
+    Used when the configured store is not shared between processes:
+    workers then only write thumbnail files, and the web process notices
+    the file exists on its first lookup and records it itself.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.data = {}
+
+    def _get_raw(self, key):
+        return self.data.get(key)
+
+    def _set_raw(self, key, value):
+        self.data[key] = value
+
+    def _delete_raw(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def _find_keys_raw(self, prefix):
+        return [key for key in self.data if key.startswith(prefix)]
+
+
+class TieredKVStore(KVStoreBase):
+    '''Bounded in-process LRU in front of a SQLite file shared by workers.
+
+    Lookups that miss the LRU read the local file instead of the main
+    database, and only keys found there are kept in memory. The file sits
+    in BASE_DIR by default, out of the publicly served MEDIA_ROOT. LRU
+    entries expire after THUMBNAIL_LRU_TIMEOUT seconds so deletes made by
+    other processes are eventually noticed.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {'lru_hits': 0, 'file_hits': 0, 'misses': 0}
+
+    @staticmethod
+    def path():
+        return settings.THUMBNAIL_KVSTORE_FILE or os.path.join(
+            settings.BASE_DIR, 'thumbnails.sqlite3'
+        )
+
+    def connect(self, path):
+        '''Connection of the current thread, the table is made on first use.'''
+        if getattr(self.local, 'path', None) == path:
+            return self.local.db
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = sqlite3.connect(path, timeout=5, isolation_level=None)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS kvstore '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+        )
+        self.local.path, self.local.db = path, db
+        return db
+
+    def stats(self):
+        '''Hit and miss counters along with the current LRU size.'''
+        with self.lock:
+            return {**self.counters, 'lru_size': len(self.entries)}
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def _remember(self, entry, value):
+        with self.lock:
+            self.entries[entry] = (
+                time.monotonic() + settings.THUMBNAIL_LRU_TIMEOUT, value
+            )
+            self.entries.move_to_end(entry)
+            while len(self.entries) > settings.THUMBNAIL_LRU_SIZE:
+                self.entries.popitem(last=False)
+
+    def _get_raw(self, key):
+        path = self.path()
+        with self.lock:
+            cached = self.entries.get((path, key))
+            if cached is not None and cached[0] > time.monotonic():
+                self.entries.move_to_end((path, key))
+                self.counters['lru_hits'] += 1
+                return cached[1]
+        row = self.connect(path).execute(
+            'SELECT value FROM kvstore WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+        self._count('file_hits')
+        self._remember((path, key), row[0])
+        return row[0]
+
+    def _set_raw(self, key, value):
+        path = self.path()
+        self.connect(path).execute(
+            'INSERT OR REPLACE INTO kvstore (key, value) VALUES (?, ?)',
+            (key, value),
+        )
+        self._remember((path, key), value)
+
+    def _delete_raw(self, *keys):
+        path = self.path()
+        self.connect(path).executemany(
+            'DELETE FROM kvstore WHERE key = ?', [(key,) for key in keys]
+        )
+        with self.lock:
+            for key in keys:
+                self.entries.pop((path, key), None)
+
+    def _find_keys_raw(self, prefix):
+        return [key for key, in self.connect(self.path()).execute(
+            'SELECT key FROM kvstore WHERE substr(key, 1, ?) = ?',
+            (len(prefix), prefix),
+        )]
+
+
+def init_worker(media_root, kvstore_file):
+    import django
+    django.setup()
+    settings.MEDIA_ROOT = media_root
+    settings.THUMBNAIL_KVSTORE_FILE = kvstore_file
+    if settings.THUMBNAIL_KVSTORE != 'posts.thumbnails.TieredKVStore':
+        settings.THUMBNAIL_KVSTORE = 'posts.thumbnails.WorkerKVStore'
+
+
+def render_thumbnails(name):
+    '''Writes every feed thumbnail of an image, runs in a worker process.
+
+    Returns a description of the error if the image could not be read.
+    '''
+    from sorl.thumbnail import get_thumbnail
+    from sorl.thumbnail.images import ImageFile
+
+    from posts.models import Post
+
+    source = ImageFile(name, Post._meta.get_field('image').storage)
+    try:
+        for geometry, options in FEED_THUMBNAILS:
+            get_thumbnail(source, geometry, **options)
+    except Exception as error:
+        return f'{name}: {error}'
+    return None
+
+
+def worker_pool(workers=None):
+    return ProcessPoolExecutor(
+        max_workers=workers or settings.THUMBNAIL_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+        initargs=(settings.MEDIA_ROOT, TieredKVStore.path()),
+    )
+
+
+def _log_failure(future):
+    error = future.exception() or future.result()
+    if error is not None:
+        logger.error('Thumbnail pre-generation failed: %s', error)
+
+
+def submit_thumbnails(name):
+    '''Hands an image to the worker pool, restarting a broken pool once.
+
+    A crashed worker breaks the pool for good. The post is saved by now,
+    so a pool that cannot take the job is logged, not raised: its
+    thumbnails are then made on the first view.
+    '''
+    global _executor
+    for _ in range(2):
+        if _executor is None:
+            _executor = worker_pool()
+        try:
+            future = _executor.submit(render_thumbnails, name)
+        except (BrokenProcessPool, RuntimeError) as error:
+            logger.error('Thumbnail workers are unusable: %s', error)
+            _executor.shutdown(wait=False)
+            _executor = None
+        else:
+            future.add_done_callback(_log_failure)
+            return
+
+
+def queue_thumbnails(name):
+    '''Renders feed thumbnails of a saved image off the request path.'''
+    if not name or not settings.THUMBNAIL_PREGENERATE:
+        return
+    transaction.on_commit(lambda: submit_thumbnails(name))
@@ -0,0 +1,248 @@
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+
+from posts.models import AuthorStats, Follow, Post, Timeline
+from posts.utils import CursorPaginator, cached_count, count_key
+
+
+def _insert(entries):
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, settings.TIMELINE_BATCH_SIZE))
+        if not batch:
+            return
+        Timeline.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def _forget_counts(user_ids):
+    cache.delete_many(
+        [count_key('timeline', user_id) for user_id in user_ids]
+    )
+
+
+def all_celebrity_ids():
+    '''Authors with too many followers to fan their posts out.'''
+    return AuthorStats.objects.filter(
+        followers_count__gt=settings.TIMELINE_FANOUT_LIMIT
+    ).values_list('user_id', flat=True)
+
+
+def celebrity_ids(user):
+    '''Authors followed by `user` whose posts are merged in at read time.'''
+    return all_celebrity_ids().filter(user__following__user=user)
+
+
+class FollowFeed:
+    '''Follow feed of a user merged from two ordered, indexed sources.
+
+    Posts of regular authors are read through the user's timeline, posts
+    of authors too popular to fan out straight from Post. `celebrities`
+    maps those authors to their post counts from AuthorStats. Slicing
+    [:stop] reads only the first `stop` posts of each source past the
+    seek position and merges them; deeper numbered pages skip to `start`
+    in SQL over the keys of both sources.
+    '''
+    model = Post
+
+    def __init__(self, user, seek=None, forward=True, celebrities=None):
+        self.user = user
+        self.seek = seek
+        self.forward = forward
+        if celebrities is not None:
+            self.celebrities = celebrities
+
+    @cached_property
+    def celebrities(self):
+        return dict(
+            celebrity_ids(self.user).values_list('user_id', 'posts_count')
+        )
+
+    def _ordered(self, queryset, date, pk, stop, **lookups):
+        '''First `stop` rows of `lookups` past the seek position.
+
+        Lookups and the seek go into one filter() so that conditions on
+        the timeline share a single join.
+        '''
+        condition = Q(**lookups)
+        if self.seek is not None:
+            lookup = 'lt' if self.forward else 'gt'
+            condition &= Q(**{f'{date}__{lookup}e': self.seek[0]}) & (
+                Q(**{f'{date}__{lookup}': self.seek[0]})
+                | Q(**{f'{pk}__{lookup}': self.seek[1]})
+            )
+        order = 'desc' if self.forward else 'asc'
+        return queryset.filter(condition).order_by(
+            getattr(F(date), order)(), getattr(F(pk), order)()
+        )[:stop]
+
+    def _merged(self, stop):
+        '''(pub_date, id, post) of the first `stop` posts in feed order.
+
+        Both sources come with their posts, `stop` is at most a page and
+        the latest post of each source past the seek position.
+        '''
+        timeline = self._ordered(
+            Post.objects.select_related('author', 'group'),
+            'timeline_entries__pub_date', 'timeline_entries__post_id', stop,
+            timeline_entries__user=self.user,
+        )
+        sources = [[(post.pub_date, post.pk, post) for post in timeline]]
+        if self.celebrities:
+            merged = self._ordered(
+                Post.objects.select_related('author', 'group'),
+                'pub_date', 'id', stop, author_id__in=list(self.celebrities),
+            )
+            sources.append([(post.pub_date, post.pk, post) for post in merged])
+        merged = heapq.merge(
+            *sources, key=lambda entry: entry[:2], reverse=self.forward
+        )
+        # An author crossing the fan-out limit may be in both for a while.
+        return list({entry[1]: entry for entry in merged}.values())
+
+    def _keys(self, start, stop):
+        '''(pub_date, id) of posts [start:stop] of the feed.
+
+        Only index entries are read up to `start`. A post in both
+        sources has the same key in each, UNION keeps one.
+        '''
+        keys = Timeline.objects.filter(user=self.user).order_by().values_list(
+            'pub_date', 'post_id'
+        )
+        if self.celebrities:
+            keys = keys.union(
+                Post.objects.filter(
+                    author_id__in=list(self.celebrities)
+                ).order_by().values_list('pub_date', 'id')
+            )
+        return keys.order_by('-pub_date', '-post_id')[start:stop]
+
+    def __getitem__(self, window):
+        if self.seek is None and window.start:
+            entries = [
+                (date, pk, None)
+                for date, pk in self._keys(window.start, window.stop)
+            ]
+        else:
+            entries = self._merged(window.stop)[window]
+        missing = [pk for _, pk, post in entries if post is None]
+        loaded = Post.objects.select_related('author', 'group').in_bulk(
+            missing
+        ) if missing else {}
+        return [
+            post or loaded[pk] for _, pk, post in entries
+            if post or pk in loaded
+        ]
+
+    def latest(self):
+        '''(pub_date, id) of the newest post, None for an empty feed.'''
+        entries = self._merged(1)
+        return entries[0][:2] if entries else None
+
+    def count(self):
+        '''Cached timeline size plus post counts of the merged authors.'''
+        return cached_count(
+            count_key('timeline', self.user.pk),
+            Timeline.objects.filter(user=self.user),
+        ) + sum(self.celebrities.values())
+
+
+class FollowPaginator(CursorPaginator):
+    '''Numbered and cursor pages of a FollowFeed.'''
+
+    def __init__(self, feed, per_page):
+        self.keys = ('pub_date', 'id')
+        self.descending = True
+        Paginator.__init__(self, feed, per_page)
+
+    def _seek(self, values, forward):
+        feed = self.object_list
+        return FollowFeed(feed.user, values, forward, feed.celebrities)
+
+
+def fan_out(post):
+    '''Copies a new post into the timelines of its author's followers.'''
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    followers = list(
+        Follow.objects.filter(author_id=post.author_id).values_list(
+            'user_id', flat=True
+        )[:limit + 1]
+    )
+    if len(followers) > limit:
+        return
+    _insert(
+        Timeline(user_id=user_id, post=post, pub_date=post.pub_date)
+        for user_id in followers
+    )
+    _forget_counts(followers)
+
+
+def _entries(follows):
+    '''Timeline entries for the posts of the followed authors.'''
+    rows = follows.filter(author__posts__isnull=False).values_list(
+        'user_id', 'author__posts', 'author__posts__pub_date'
+    )
+    for user_id, post_id, pub_date in rows.iterator():
+        yield Timeline(user_id=user_id, post_id=post_id, pub_date=pub_date)
+
+
+def _followers_count(author_id):
+    return AuthorStats.objects.filter(user_id=author_id).values_list(
+        'followers_count', flat=True
+    ).first() or 0
+
+
+def _follower_ids(author_id):
+    return Follow.objects.filter(author_id=author_id).values_list(
+        'user_id', flat=True
+    )
+
+
+def backfill(follow):
+    '''Adds the author's existing posts to a new follower's timeline.
+
+    A follow taking the author over TIMELINE_FANOUT_LIMIT removes their
+    posts from every timeline instead, they are merged at read time.
+    '''
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    followers = _followers_count(follow.author_id)
+    if followers > limit + 1:
+        return
+    if followers == limit + 1:
+        Timeline.objects.filter(post__author_id=follow.author_id).delete()
+        _forget_counts(_follower_ids(follow.author_id))
+        return
+    _insert(_entries(Follow.objects.filter(pk=follow.pk)))
+    _forget_counts([follow.user_id])
+
+
+def prune(follow):
+    '''Drops the author's posts from the timeline of a former follower.
+
+    An unfollow taking the author back to TIMELINE_FANOUT_LIMIT fans all
+    their posts out to the remaining followers, including the ones
+    published while over it.
+    '''
+    Timeline.objects.filter(
+        user_id=follow.user_id, post__author_id=follow.author_id
+    ).delete()
+    _forget_counts([follow.user_id])
+    if _followers_count(follow.author_id) == settings.TIMELINE_FANOUT_LIMIT:
+        _insert(_entries(Follow.objects.filter(author_id=follow.author_id)))
+        _forget_counts(_follower_ids(follow.author_id))
+
+
+def rebuild(user_ids, celebrities=()):
+    '''Recreates the timelines of the given users from Follow and Post.'''
+    Timeline.objects.filter(user_id__in=user_ids).delete()
+    _insert(_entries(
+        Follow.objects.filter(user_id__in=user_ids).exclude(
+            author_id__in=celebrities
+        )
+    ))
+    _forget_counts(user_ids)
@@ -1,10 +1,268 @@
-from django.core.paginator import Paginator
+import base64
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max, Q
+from django.utils.functional import cached_property
+from django.utils.translation import get_language
+
+
+class CursorPage(Page):
+    '''Page of a keyset paginator, navigated by cursors instead of numbers.'''
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        super().__init__(object_list, None, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<Cursor page of {len(self)} items>'
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return self.paginator.cursor_for(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        return self.paginator.cursor_for(self.object_list[0])
+
+
+class CursorPaginator(Paginator):
+    '''Paginator that can seek by a (timestamp, id) key instead of OFFSET.
+
+    Numbered pages still work through the regular Paginator API, cursor
+    pages are built by cursor_page() and never run COUNT(*).
+    '''
+
+    def __init__(self, object_list, per_page,
+                 keys=('pub_date', 'id'), descending=True):
+        self.keys = keys
+        self.descending = descending
+        super().__init__(
+            object_list.order_by(*self._ordering(True)), per_page
+        )
+
+    def cursor_for(self, obj):
+        '''Packs key values of a row into an opaque url-safe token.'''
+        values = []
+        for key in self.keys:
+            value = obj[key] if isinstance(obj, dict) else getattr(obj, key)
+            values.append(
+                value.isoformat() if hasattr(value, 'isoformat') else value
+            )
+        raw = json.dumps(values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        '''Returns key values from a token or None if it is malformed.'''
+        if not token:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            values = json.loads(raw)
+            model = self.object_list.model
+            return [
+                model._meta.get_field(key).to_python(value)
+                for key, value in zip(self.keys, values)
+            ] if len(values) == len(self.keys) else None
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def _ordering(self, forward):
+        prefix = '-' if forward == self.descending else ''
+        return [prefix + key for key in self.keys]
+
+    def _seek(self, values, forward):
+        first, second = self.keys
+        lookup = 'lt' if forward == self.descending else 'gt'
+        condition = (
+            Q(**{f'{first}__{lookup}': values[0]})
+            | Q(**{first: values[0], f'{second}__{lookup}': values[1]})
+        )
+        return self.object_list.filter(condition).order_by(
+            *self._ordering(forward)
+        )
+
+    def cursor_page(self, after=None, before=None):
+        '''Returns the page following `after` or preceding `before`.'''
+        before = self.decode_cursor(before)
+        if before is not None:
+            rows = list(self._seek(before, forward=False)[:self.per_page + 1])
+            if len(rows) <= self.per_page:
+                return self.cursor_page()
+            return CursorPage(
+                rows[:self.per_page][::-1], self,
+                has_next=True, has_previous=True,
+            )
+        after = self.decode_cursor(after)
+        if after is None:
+            queryset = self.object_list
+        else:
+            queryset = self._seek(after, forward=True)
+        rows = list(queryset[:self.per_page + 1])
+        return CursorPage(
+            rows[:self.per_page], self,
+            has_next=len(rows) > self.per_page,
+            has_previous=after is not None,
+        )
+
+
+class CachedCountPaginator(CursorPaginator):
+    '''Paginator that reads its row count from a counter kept in cache.
+
+    The counter is filled by one COUNT(*) on a miss and then moved by
+    Post signals, see posts.signals.
+    '''
+
+    def __init__(self, object_list, per_page, count_key, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_key = count_key
+
+    @cached_property
+    def count(self):
+        return cached_count(self.count_key, self.object_list)
+
+
+def cached_count(key, queryset):
+    '''Row count of a feed from its cached counter, filled on a miss.'''
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.add(key, count, settings.FEED_COUNT_TIMEOUT)
+    return count
+
+
+def count_key(feed, pk=None):
+    '''Cache key of a feed's post counter.'''
+    if pk is None:
+        return f'posts:count:{feed}'
+    return f'posts:count:{feed}:{pk}'
+
+
+def adjust_count(key, delta):
+    '''Moves a cached counter, counters that are not cached are skipped.'''
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        pass
+
+
+FEED_VERSION_KEY = 'posts:feed_version'
+
+
+def feed_version():
+    '''Current version of all feeds, part of every feed cache key.
+
+    A missing version starts from the clock so it never repeats a value
+    that may still be cached.
+    '''
+    return cache.get_or_set(
+        FEED_VERSION_KEY, lambda: int(time.time() * 1000), None
+    )
+
+
+def bump_feed_version():
+    '''Makes every cached feed fragment stale.'''
+    try:
+        cache.incr(FEED_VERSION_KEY)
+    except ValueError:
+        feed_version()
+
+
+def make_etag(*parts):
+    return hashlib.md5(
+        ':'.join(str(part) for part in parts).encode()
+    ).hexdigest()
+
+
+def feed_etag(posts, count_key=None, *vary_on):
+    '''Validator of a feed built from its newest pub_date and post count.
+
+    The feed version is mixed in as well, so edits that keep both
+    unchanged still produce a new tag.
+    '''
+    if count_key is None:
+        state = posts.aggregate(latest=Max('pub_date'), total=Count('pk'))
+    else:
+        state = posts.aggregate(latest=Max('pub_date'))
+        state['total'] = cached_count(count_key, posts)
+    return make_etag(
+        state['latest'], state['total'], feed_version(), *vary_on
+    )
+
+
+def page_etag(request, *validators):
+    '''ETag of an HTML page: its validators plus who asks for what.
+
+    Pages differ per user and embed a CSRF token, so both are part of
+    the tag along with the query string.
+    '''
+    return make_etag(
+        request.user.pk,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+        request.GET.urlencode(),
+        *validators,
+    )
+
+
+def feed_cache_key(feed, request, *vary_on):
+    '''Cache key of a feed fragment for the requested page or cursor.'''
+    parts = [str(part) for part in vary_on] + [
+        request.GET.get(param, '') for param in ('page', 'after', 'before')
+    ]
+    digest = hashlib.md5(':'.join(parts).encode()).hexdigest()
+    return f'posts:feed:{feed}:{feed_version()}:{digest}'
+
+
+def card_cache_key(post, variant):
+    '''Cache key of a rendered post card, new for every saved version.
+
+    Names of the author and the group slug are shown on cards without
+    changing the post, so they are part of the key as well.
+    '''
+    digest = make_etag(
+        get_language(), post.author.username, post.author.get_full_name(),
+        post.group.slug if post.group_id else '',
+    )
+    return (
+        f'posts:card:{variant}:{post.pk}:'
+        f'{post.updated_at.timestamp()}:{digest}'
+    )
+
+
+def page_of(paginator, request):
+    '''Page of a paginator asked for by ?page=, ?after= or ?before=.'''
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if after or before:
+        return paginator.cursor_page(after=after, before=before)
+    return paginator.get_page(request.GET.get('page'))
+
 
+def pages_paginator(post, request, count_key=None):
+    '''Dispalays last 10 newest posts.
 
-def pages_paginator(post, request):
-    '''Dispalays last 10 newest posts.'''
-    paginator = Paginator(post, settings.MAX_POSTS)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return page_obj
+    Requests with ?after= or ?before= cursors are served by keyset
+    pagination, ?page= keeps the numbered pages. With `count_key` the
+    number of pages comes from a cached counter instead of COUNT(*).
+    '''
+    if count_key is None:
+        paginator = CursorPaginator(post, settings.MAX_POSTS)
+    else:
+        paginator = CachedCountPaginator(post, settings.MAX_POSTS, count_key)
+    return page_of(paginator, request)
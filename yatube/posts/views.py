@@ -1,60 +1,128 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.db.models import Exists, Max, OuterRef, Subquery
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
 
 
-from posts.models import Post, Group, User, Follow
+from posts.models import Comment, Post, Group, User, Follow
 from posts.forms import PostForm, CommentForm
-from posts.utils import pages_paginator
+from posts.ndjson import author_querysets, dump, gzipped
+from posts.search import SearchResults
+from posts.stats import stats_for
+from posts.thumbnails import queue_thumbnails
+from posts.timeline import FollowFeed, FollowPaginator
+from posts.utils import (
+    CursorPaginator, count_key, feed_version, page_etag, page_of,
+    pages_paginator
+)
+
+
+def index_etag(request):
+    '''The feed version alone, it moves on every Post and Group change.'''
+    return page_etag(request, feed_version())
+
+
+def group_etag(request, slug):
+    return page_etag(request, feed_version(), slug)
+
+
+def profile_etag(request, username):
+    '''Posts, counters and the follow button state in one query.'''
+    state = User.objects.filter(username=username).annotate(
+        latest=Max('posts__pub_date'),
+        is_following=Exists(Follow.objects.filter(
+            user_id=request.user.pk, author=OuterRef('pk')
+        )),
+    ).values_list(
+        'latest', 'is_following', 'stats__posts_count',
+        'stats__followers_count', 'stats__following_count',
+    ).first()
+    return page_etag(request, state, feed_version())
+
 
+def post_detail_etag(request, post_id):
+    '''Post version and its newest comment, both read through indexes.'''
+    state = Post.objects.filter(pk=post_id).annotate(
+        latest_comment=Subquery(
+            Comment.objects.filter(post=OuterRef('pk')).order_by(
+                '-created', '-pk'
+            ).values('pk')[:1]
+        ),
+    ).values_list('updated_at', 'latest_comment').first()
+    return page_etag(request, state, feed_version())
 
+
+@condition(etag_func=index_etag)
 def index(request):
     '''Shows main page and last 10 posts.'''
-    post_list = Post.objects.all()
+    post_list = Post.objects.select_related('author', 'group')
     context = {
-        'page_obj': pages_paginator(post_list, request),
+        'page_obj': pages_paginator(
+            post_list, request, count_key('index')
+        ),
     }
     return render(request, 'posts/index.html', context)
 
 
+@condition(etag_func=group_etag)
 def group_posts(request, slug):
     '''Shows last 10 group's posts.'''
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
+    posts = group.posts.select_related('author')
     context = {
         'group': group,
-        'page_obj': pages_paginator(posts, request),
+        'page_obj': pages_paginator(
+            posts, request, count_key('group', group.pk)
+        ),
     }
     template = 'posts/group_list.html'
     return render(request, template, context)
 
 
+@condition(etag_func=profile_etag)
 def profile(request, username):
     '''Shows user's profile and his last 10 posts.'''
     author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    post_count = post_list.count()
+    post_list = author.posts.select_related('group')
+    page_obj = pages_paginator(
+        post_list, request, count_key('author', author.pk)
+    )
     if request.user.is_authenticated:
         following = Follow.objects.filter(
             user=request.user, author=author
         ).exists()
     else:
         following = False
+    stats = stats_for(author)
     context = {
-        'post_count': post_count,
+        'post_count': stats.posts_count,
+        'followers_count': stats.followers_count,
+        'following_count': stats.following_count,
         'author': author,
-        'page_obj': pages_paginator(post_list, request),
+        'page_obj': page_obj,
         'following': following
 
     }
     return render(request, 'posts/profile.html', context)
 
 
+@condition(etag_func=post_detail_etag)
 def post_detail(request, post_id):
     '''Shows post's details.'''
-    post_detail = get_object_or_404(Post, pk=post_id)
-    count = post_detail.author.posts.count()
+    post_detail = get_object_or_404(
+        Post.objects.select_related('author', 'group'), pk=post_id
+    )
+    count = stats_for(post_detail.author).posts_count
     form = CommentForm(request.POST or None)
-    comments = post_detail.comments.all()
+    comments = comments_page(
+        post_detail.comments.all(), request.GET.get('comments_after')
+    )
     context = {
         'post_detail': post_detail,
         'count': count,
@@ -64,6 +132,29 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def comments_page(comments, after):
+    '''Next batch of comments, oldest first, with authors in one query.'''
+    paginator = CursorPaginator(
+        comments.select_related('author'),
+        settings.COMMENTS_PER_PAGE,
+        keys=('created', 'id'),
+        descending=False,
+    )
+    return paginator.cursor_page(after=after)
+
+
+def comment_list(request, post_id):
+    '''Renders one batch of a post's comments for "load more".'''
+    context = {
+        'post_id': post_id,
+        'comments': comments_page(
+            Comment.objects.filter(post_id=post_id),
+            request.GET.get('after'),
+        ),
+    }
+    return render(request, 'includes/comment_list.html', context)
+
+
 @login_required
 def post_create(request):
     '''Allows user to create post if logget in.'''
@@ -73,6 +164,7 @@ def post_create(request):
     data = form.save(commit=False)
     data.author = request.user
     data.save()
+    queue_thumbnails(data.image.name)
     return redirect('posts:profile', data.author)
 
 
@@ -80,7 +172,7 @@ def post_create(request):
 def post_edit(request, post_id):
     '''Allows user to change post if user is author.'''
     post = get_object_or_404(Post, id=post_id)
-    if request.user != post.author:
+    if request.user.pk != post.author_id:
         return redirect('posts:post_detail', post.pk)
     form = PostForm(request.POST or None,
                     instance=post,
@@ -95,6 +187,8 @@ def post_edit(request, post_id):
     if not form.is_valid():
         return render(request, 'posts/create_post.html', {'form': form})
     form.save()
+    if 'image' in form.changed_data:
+        queue_thumbnails(post.image.name)
     return redirect('posts:post_detail', post.pk)
 
 
@@ -110,15 +204,51 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+def search(request):
+    '''Shows posts matching ?q=, best matches first.'''
+    query = request.GET.get('q', '').strip()
+    paginator = Paginator(SearchResults(query), settings.MAX_POSTS)
+    context = {
+        'query': query,
+        'page_obj': paginator.get_page(request.GET.get('page')),
+        'page_query': urlencode({'q': query}) + '&' if query else '',
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
+    paginator = FollowPaginator(
+        FollowFeed(request.user), settings.MAX_POSTS
+    )
     context = {
-        'page_obj': pages_paginator(posts, request),
+        'page_obj': page_of(paginator, request),
     }
     return render(request, 'posts/follow.html', context)
 
 
+@login_required
+def profile_export(request, username):
+    '''Streams the author's posts, their comments and follows as NDJSON.'''
+    author = get_object_or_404(User, username=username)
+    if request.user != author:
+        return redirect('posts:profile', username)
+    chunks = dump(author_querysets(author))
+    accepts = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    compress = request.GET.get('gzip') or 'gzip' in accepts
+    response = StreamingHttpResponse(
+        gzipped(chunks) if compress else chunks,
+        content_type='application/x-ndjson',
+    )
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Content-Disposition'] = (
+        f'attachment; filename="{author.username}.ndjson"'
+    )
+    return response
+
+
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
@@ -130,10 +260,5 @@ def profile_follow(request, username):
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    obj = Follow.objects.filter(
-        user=request.user,
-        author=author
-    )
-    if obj.exists():
-        obj.delete()
+    Follow.objects.filter(user=request.user, author=author).delete()
     return redirect('posts:follow_index')
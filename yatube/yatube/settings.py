@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -51,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.SlowQueryMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,6 +61,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -65,7 +69,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.profiling.ProfiledTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -144,10 +148,108 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.InstrumentedLocMemCache',
     }
 }
+# Workers of one host share a cache file, size is bounded by MAX_ENTRIES.
+if not DEBUG:
+    CACHES['default'] = {
+        'BACKEND': 'core.cache.InstrumentedSQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
 
 MAX_POSTS = 10
+COMMENTS_PER_PAGE = 20
+
+IMAGE_MAX_SIZE = 2048
+IMAGE_JPEG_QUALITY = 85
+
+THUMBNAIL_PREGENERATE = True
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_BACKEND = 'core.profiling.ProfiledThumbnailBackend'
+THUMBNAIL_KVSTORE = 'posts.thumbnails.TieredKVStore'
+THUMBNAIL_KVSTORE_FILE = os.path.join(BASE_DIR, 'thumbnails.sqlite3')
+THUMBNAIL_LRU_SIZE = 10000
+THUMBNAIL_LRU_TIMEOUT = 5 * 60
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
+
+FEED_COUNT_TIMEOUT = 60 * 60
+FEED_CACHE_TIMEOUT = 60 * 60
+FEED_CACHE_GRACE = 10 * 60
+POST_CARD_TIMEOUT = 24 * 60 * 60
+
+TIMELINE_FANOUT_LIMIT = 10000
+TIMELINE_BATCH_SIZE = 1000
+
+QUERY_BUDGETS = {
+    'posts:index': 5,
+    'posts:group_list': 6,
+    'posts:profile': 8,
+    'posts:post_detail': 6,
+    'posts:post_create': 12,
+    'posts:post_edit': 13,
+    'posts:add_comment': 4,
+    'posts:comment_list': 1,
+    'posts:search': 5,
+    'posts:follow_index': 6,
+    'posts:profile_export': 3,
+    'posts:profile_follow': 12,
+    'posts:profile_unfollow': 10,
+    'api:index': 3,
+    'api:group_list': 4,
+    'api:profile': 4,
+    'api:follow_index': 8,
+}
+QUERY_REPEAT_LIMIT = 3
+
+# Server-Timing reveals query counts, it is only sent to staff users.
+PROFILING_HEADER = False
+PROFILING_LOG = False
+
+# Every worker process writes its counters here for /metrics to merge.
+# Counters of workers that are gone are moved into archive.json by the
+# next scrape, so the sums never go down.
+METRICS_DIR = os.path.join(tempfile.gettempdir(), 'yatube-metrics')
+METRICS_FLUSH_INTERVAL = 1
+# Scrapers send it as "Authorization: Bearer <token>". Without a token
+# only staff users can read /metrics.
+METRICS_TOKEN = None
+
+SLOW_QUERY_LOG = False
+SLOW_QUERY_THRESHOLD_MS = 100
+SLOW_QUERY_SAMPLE_RATE = 1.0
+SLOW_QUERY_STACK_DEPTH = 8
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.path.join(BASE_DIR, 'slow_queries.log'),
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 3,
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'core.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'core.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'posts.images': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}